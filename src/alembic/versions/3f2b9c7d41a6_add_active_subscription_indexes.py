@@ -0,0 +1,91 @@
+"""Add active subscription indexes
+
+Revision ID: 3f2b9c7d41a6
+Revises: d82555e37aa2
+Create Date: 2026-10-18 09:12:40.512730
+
+"""
+from contextlib import contextmanager
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f2b9c7d41a6'
+down_revision: Union[str, None] = 'd82555e37aa2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # The old check-then-insert was racy, so a user may already hold several
+    # active subscriptions for the same magazine and plan. Keep the oldest
+    # active one of each group; the unique index cannot be built otherwise.
+    subscriptions = sa.table(
+        'subscriptions',
+        sa.column('id', sa.Integer),
+        sa.column('user_id', sa.Integer),
+        sa.column('magazine_id', sa.Integer),
+        sa.column('plan_id', sa.Integer),
+        sa.column('is_active', sa.Boolean),
+    )
+    older = subscriptions.alias('older')
+    op.execute(
+        subscriptions.update()
+        .where(
+            subscriptions.c.is_active == sa.true(),
+            sa.exists().where(
+                older.c.is_active == sa.true(),
+                older.c.user_id == subscriptions.c.user_id,
+                older.c.magazine_id == subscriptions.c.magazine_id,
+                older.c.plan_id == subscriptions.c.plan_id,
+                older.c.id < subscriptions.c.id,
+            ),
+        )
+        .values(is_active=False)
+    )
+
+    # On Postgres the indexes are built without blocking writes to
+    # subscriptions, which CREATE INDEX CONCURRENTLY cannot do in a transaction
+    with _concurrently() as concurrently:
+        op.create_index(
+            'uq_subscriptions_active_user_magazine_plan',
+            'subscriptions',
+            ['user_id', 'magazine_id', 'plan_id'],
+            unique=True,
+            postgresql_where=sa.text('is_active'),
+            sqlite_where=sa.text('is_active'),
+            postgresql_concurrently=concurrently,
+        )
+        op.create_index(
+            'ix_subscriptions_user_id_is_active',
+            'subscriptions',
+            ['user_id', 'is_active'],
+            unique=False,
+            postgresql_concurrently=concurrently,
+        )
+
+
+def downgrade() -> None:
+    with _concurrently() as concurrently:
+        op.drop_index(
+            'ix_subscriptions_user_id_is_active',
+            table_name='subscriptions',
+            postgresql_concurrently=concurrently,
+        )
+        op.drop_index(
+            'uq_subscriptions_active_user_magazine_plan',
+            table_name='subscriptions',
+            postgresql_concurrently=concurrently,
+        )
+
+
+@contextmanager
+def _concurrently():
+    if op.get_bind().dialect.name != 'postgresql':
+        yield False
+        return
+    with op.get_context().autocommit_block():
+        yield True
@@ -0,0 +1,28 @@
+"""Add subscription renewal lease
+
+Revision ID: a7c4e2d90b13
+Revises: 3f2b9c7d41a6
+Create Date: 2026-10-18 11:02:17.304518
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7c4e2d90b13'
+down_revision: Union[str, None] = '3f2b9c7d41a6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('subscriptions', sa.Column('lease_owner', sa.String(), nullable=True))
+    op.add_column('subscriptions', sa.Column('lease_expires_at', sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('subscriptions', 'lease_expires_at')
+    op.drop_column('subscriptions', 'lease_owner')
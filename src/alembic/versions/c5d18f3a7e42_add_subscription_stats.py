@@ -0,0 +1,41 @@
+"""Add subscription stats
+
+Revision ID: c5d18f3a7e42
+Revises: a7c4e2d90b13
+Create Date: 2026-10-18 14:26:51.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5d18f3a7e42'
+down_revision: Union[str, None] = 'a7c4e2d90b13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'subscription_stats',
+        sa.Column('magazine_id', sa.Integer(), nullable=False),
+        sa.Column('plan_id', sa.Integer(), nullable=False),
+        sa.Column('active_count', sa.Integer(), nullable=False),
+        sa.Column('active_revenue', sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(['magazine_id'], ['magazines.id'], ),
+        sa.ForeignKeyConstraint(['plan_id'], ['plans.id'], ),
+        sa.PrimaryKeyConstraint('magazine_id', 'plan_id')
+    )
+    # Start from the current subscriptions
+    op.execute(
+        'INSERT INTO subscription_stats (magazine_id, plan_id, active_count, active_revenue) '
+        'SELECT magazine_id, plan_id, count(*), sum(price) FROM subscriptions '
+        'WHERE is_active GROUP BY magazine_id, plan_id'
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('subscription_stats')
@@ -0,0 +1,33 @@
+"""Add active renewal date index
+
+Revision ID: e2a9b4c61f08
+Revises: c5d18f3a7e42
+Create Date: 2026-10-18 15:40:03.672391
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2a9b4c61f08'
+down_revision: Union[str, None] = 'c5d18f3a7e42'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'ix_subscriptions_active_renewal_date',
+        'subscriptions',
+        ['renewal_date', 'id'],
+        unique=False,
+        postgresql_where=sa.text('is_active'),
+        sqlite_where=sa.text('is_active'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_subscriptions_active_renewal_date', table_name='subscriptions')
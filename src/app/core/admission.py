@@ -0,0 +1,210 @@
+# admission.py
+#
+# Admission control per route class. Each class (auth, catalog, subscription
+# writes) has a concurrency limit that adapts AIMD-style to latency: every
+# fast completion raises it by 1/limit, a completion much slower than the
+# class's long-term average (or a 503 from downstream) cuts it by a factor.
+# Requests over the limit wait in a FIFO queue; when the expected wait is
+# longer than the queue deadline they are rejected at once with 503 and a
+# Retry-After, so overload sheds requests instead of piling up behind the
+# database pool or the password hashers.
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Dict, Optional
+
+import orjson
+
+from app.core.config import settings
+
+AUTH = "auth"
+CATALOG = "catalog"
+SUBSCRIPTION_WRITES = "subscription_writes"
+
+
+def route_class(method: str, path: str) -> Optional[str]:
+    if method == "POST" and path.startswith("/users/"):
+        return AUTH
+    if method == "GET" and path.startswith(("/magazines", "/plans", "/pricing")):
+        return CATALOG
+    if method == "POST" and path.startswith("/subscriptions"):
+        return SUBSCRIPTION_WRITES
+    return None
+
+
+class Overloaded(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__("Server overloaded, retry later.")
+        self.retry_after = retry_after
+
+
+class AdaptiveLimiter:
+    def __init__(
+        self,
+        initial_limit: int,
+        min_limit: int = 1,
+        max_limit: int = 256,
+        queue_timeout: float = 1.0,
+        tolerance: float = 2.0,
+        backoff: float = 0.9,
+        smoothing: float = 0.05,
+    ):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.queue_timeout = queue_timeout
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.smoothing = smoothing
+        # Long-term average latency, the yardstick for "slow"
+        self.baseline: Optional[float] = None
+        self.in_flight = 0
+        self.rejected = 0
+        self._waiters: deque = deque()
+
+    def expected_wait(self) -> float:
+        # Each slot frees up about once per average latency
+        if self.baseline is None:
+            return 0.0
+        return (len(self._waiters) + 1) / max(self.limit, 1.0) * self.baseline
+
+    def _reject(self, wait: float):
+        self.rejected += 1
+        raise Overloaded(retry_after=max(wait, self.baseline or 0.0))
+
+    async def acquire(self):
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return
+        wait = self.expected_wait()
+        if wait > self.queue_timeout:
+            self._reject(wait)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            # A slot handed over just as the deadline passed is still ours
+            if not waiter.done() or waiter.cancelled():
+                self._reject(self.queue_timeout)
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+        # The slot was handed over by release()
+
+    def release(self, latency: float, overloaded: bool = False):
+        self.in_flight -= 1
+        if self.baseline is None:
+            self.baseline = latency
+        slow = overloaded or latency > self.baseline * self.tolerance
+        self.baseline += self.smoothing * (latency - self.baseline)
+        if slow:
+            self.limit = max(self.min_limit, self.limit * self.backoff)
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+
+class AdmissionController:
+    def __init__(self, limits: Dict[str, int], **options):
+        self.limiters = {
+            name: AdaptiveLimiter(limit, **options) for name, limit in limits.items()
+        }
+
+    def render(self) -> str:
+        lines = []
+        for name, help_text, kind, attr in (
+            ("admission_limit", "Current concurrency limit.", "gauge", "limit"),
+            (
+                "admission_in_flight",
+                "Admitted requests in progress.",
+                "gauge",
+                "in_flight",
+            ),
+            ("admission_queued", "Requests waiting for a slot.", "gauge", "queued"),
+            (
+                "admission_rejected_total",
+                "Requests shed with 503.",
+                "counter",
+                "rejected",
+            ),
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for route_class_name, limiter in sorted(self.limiters.items()):
+                lines.append(
+                    f'{name}{{class="{route_class_name}"}} {getattr(limiter, attr)}'
+                )
+        lines.append("")
+        return "\n".join(lines)
+
+
+admission = AdmissionController(
+    settings.admission_limits,
+    min_limit=settings.admission_min_limit,
+    max_limit=settings.admission_max_limit,
+    queue_timeout=settings.admission_queue_timeout,
+)
+
+
+class AdmissionMiddleware:
+    def __init__(self, app, controller: AdmissionController = admission):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        limiter = None
+        if scope["type"] == "http" and settings.admission_control_enabled:
+            limiter = self.controller.limiters.get(
+                route_class(scope["method"], scope["path"])
+            )
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await limiter.acquire()
+        except Overloaded as e:
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 503,
+                    "headers": [
+                        (b"content-type", b"application/json"),
+                        (
+                            b"retry-after",
+                            str(max(1, math.ceil(e.retry_after))).encode(),
+                        ),
+                    ],
+                }
+            )
+            await send(
+                {
+                    "type": "http.response.body",
+                    "body": orjson.dumps({"detail": str(e)}),
+                }
+            )
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            limiter.release(time.perf_counter() - start, overloaded=status == 503)
@@ -0,0 +1,61 @@
+# auth.py
+#
+# Bearer-token dependencies. get_current_identity answers "who is calling"
+# from the verified token claims alone; get_current_user loads the User row
+# for the handlers that need more than the identity.
+from dataclasses import dataclass
+from typing import Optional
+
+from fastapi import Depends, HTTPException
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.jwt import ACCESS_TOKEN, InvalidToken, decode_token
+from app.db.session import get_db
+from app.models import User
+
+bearer_scheme = HTTPBearer(auto_error=False)
+
+
+@dataclass(frozen=True)
+class Identity:
+    username: str
+    user_id: Optional[int] = None
+
+
+def _unauthorized(detail: str) -> HTTPException:
+    return HTTPException(
+        status_code=401, detail=detail, headers={"WWW-Authenticate": "Bearer"}
+    )
+
+
+def token_identity(
+    credentials: Optional[HTTPAuthorizationCredentials], token_type: str
+) -> Identity:
+    if credentials is None:
+        raise _unauthorized("Not authenticated")
+    try:
+        claims = decode_token(credentials.credentials, token_type)
+    except InvalidToken as e:
+        raise _unauthorized(str(e))
+    return Identity(username=claims["sub"], user_id=claims.get("uid"))
+
+
+async def get_current_identity(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme),
+) -> Identity:
+    return token_identity(credentials, ACCESS_TOKEN)
+
+
+async def get_current_user(
+    identity: Identity = Depends(get_current_identity),
+    db: AsyncSession = Depends(get_db),
+) -> User:
+    if identity.user_id is not None:
+        user = await db.get(User, identity.user_id)
+    else:
+        user = await db.scalar(select(User).where(User.username == identity.username))
+    if user is None or user.username != identity.username:
+        raise _unauthorized("User not found")
+    return user
@@ -0,0 +1,69 @@
+# cache.py
+import hashlib
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+
+@dataclass(frozen=True)
+class CachedResponse:
+    body: bytes
+    etag: str
+    version: int
+    expires_at: float
+
+
+def make_etag(body: bytes) -> str:
+    return '"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison function
+    candidates = (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+    return etag.removeprefix("W/") in candidates
+
+
+class VersionedCache:
+    """Pre-encoded response bodies tagged with the data version they were built from.
+
+    ``invalidate()`` bumps the version, which drops every entry at once. A
+    body computed from a read that raced with an invalidation is handed back
+    to its caller but never stored.
+    """
+
+    def __init__(self, ttl: float, max_entries: int = 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.version = 0
+        self._entries: Dict[str, CachedResponse] = {}
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        if entry is None or entry.version != self.version:
+            return None
+        if entry.expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        return entry
+
+    def set(self, key: str, body: bytes, version: int) -> CachedResponse:
+        entry = CachedResponse(
+            body=body,
+            etag=make_etag(body),
+            version=version,
+            expires_at=time.monotonic() + self.ttl,
+        )
+        if version == self.version:
+            if key not in self._entries and len(self._entries) >= self.max_entries:
+                # Evict the oldest entry
+                del self._entries[next(iter(self._entries))]
+            self._entries[key] = entry
+        return entry
+
+    def invalidate(self):
+        self.version += 1
+        self._entries.clear()
@@ -0,0 +1,116 @@
+# config.py
+import secrets
+from typing import Dict, Optional
+
+from pydantic import field_validator, model_validator
+from pydantic_settings import BaseSettings
+
+# Well-known values that must never sign tokens
+PLACEHOLDER_SECRETS = frozenset({"change-me", "changeme", "secret"})
+MIN_SECRET_LENGTH = 32
+
+
+class Settings(BaseSettings):
+    database_url: str = "postgresql+psycopg2://app_user:app_password@db/app"
+    # Defaults to database_url with the matching async driver
+    async_database_url: Optional[str] = None
+    # Connections kept open per engine (i.e. per worker process), plus how
+    # many more may be opened under load. A worker holds at most
+    # db_pool_size + db_max_overflow connections.
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    # Seconds a request waits for a free connection before failing
+    db_pool_timeout: float = 30.0
+    # Reopen connections older than this many seconds (-1 disables)
+    db_pool_recycle: int = 1800
+    # Test connections with a round trip on checkout
+    db_pool_pre_ping: bool = True
+    # Read-only replica for GET endpoints; reads use the primary when unset
+    replica_database_url: Optional[str] = None
+    # Seconds after a write during which the same client reads from the
+    # primary, so it sees its own changes despite replication lag
+    read_your_writes_window: float = 5.0
+
+    # Password hashing runs in a separate process pool. A worker count of 0
+    # falls back to the event loop's default thread pool.
+    password_hash_workers: int = 2
+    # Hash/verify calls allowed to wait for a worker before new ones are rejected
+    password_hash_max_pending: int = 64
+    # bcrypt cost factor, the same for every worker. Stored hashes at any other
+    # cost are rehashed on the next successful login; leave unset to keep
+    # passlib's default. `python -m app.core.security` picks the highest cost
+    # that hashes within password_hash_target_ms on this host.
+    bcrypt_rounds: Optional[int] = None
+    password_hash_target_ms: float = 250.0
+
+    # Seconds a rendered catalog stays valid. Writes through this worker
+    # invalidate it immediately; the TTL bounds staleness across workers.
+    catalog_cache_ttl: float = 300.0
+
+    # Admission control: starting concurrency limit per route class. Limits
+    # then adapt to latency between admission_min_limit and admission_max_limit.
+    admission_control_enabled: bool = True
+    admission_limits: Dict[str, int] = {
+        "auth": 16,
+        "catalog": 64,
+        "subscription_writes": 32,
+    }
+    admission_min_limit: int = 1
+    admission_max_limit: int = 256
+    # Longest a request may wait for a slot before it is shed with a 503
+    admission_queue_timeout: float = 1.0
+
+    # Signing key for access and refresh tokens, the same for every worker.
+    # Required unless jwt_dev_secret is set.
+    jwt_secret_key: Optional[str] = None
+    # Sign with a random key of this process's own when jwt_secret_key is
+    # unset. Only suits a single-process dev server: no other worker accepts
+    # its tokens, and they stop working on restart.
+    jwt_dev_secret: bool = False
+    jwt_algorithm: str = "HS256"
+    access_token_expire_minutes: float = 30.0
+    refresh_token_expire_days: float = 7.0
+    # Verified token claims kept in memory, per worker
+    jwt_cache_max_entries: int = 10000
+
+    # Bloom filter over registered usernames and emails, per worker. Sized
+    # for at least this many entries (two per user) at the given rate of
+    # false "maybe taken" answers, which fall back to a database lookup.
+    user_filter_capacity: int = 1_000_000
+    user_filter_error_rate: float = 0.01
+    # Seconds between background reloads, which bounds how long users
+    # registered through other workers look available here
+    user_filter_ttl: float = 300.0
+
+    # Largest batch accepted by POST /subscriptions/bulk
+    bulk_subscription_max_items: int = 10000
+    # Rows fetched per round trip by streaming exports
+    export_chunk_size: int = 1000
+    # Rows per upsert statement in POST /catalog/import
+    catalog_import_batch_size: int = 500
+
+    @field_validator("jwt_secret_key")
+    @classmethod
+    def _reject_weak_secret(cls, value: Optional[str]) -> Optional[str]:
+        if value is None:
+            return value
+        if value.lower() in PLACEHOLDER_SECRETS or len(value) < MIN_SECRET_LENGTH:
+            raise ValueError(
+                f"jwt_secret_key must be a random value of at least "
+                f"{MIN_SECRET_LENGTH} characters"
+            )
+        return value
+
+    @model_validator(mode="after")
+    def _require_secret(self) -> "Settings":
+        if self.jwt_secret_key is None:
+            if not self.jwt_dev_secret:
+                raise ValueError(
+                    "jwt_secret_key must be set, or jwt_dev_secret for a "
+                    "single-process dev server"
+                )
+            self.jwt_secret_key = secrets.token_urlsafe(MIN_SECRET_LENGTH)
+        return self
+
+
+settings = Settings()
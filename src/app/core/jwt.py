@@ -0,0 +1,108 @@
+# jwt.py
+#
+# Access and refresh tokens. Verifying a token (signature, expiry, claims)
+# costs far more than the cheap endpoints it guards, and clients send the same
+# token on every request, so verified claims are cached per worker until the
+# token expires.
+import hashlib
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from app.core.config import settings
+
+ACCESS_TOKEN = "access"
+REFRESH_TOKEN = "refresh"
+
+
+class InvalidToken(Exception):
+    pass
+
+
+class TokenCache:
+    """LRU of verified claims, keyed by token digest, that drops each entry
+    when its token expires."""
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[bytes, dict]" = OrderedDict()
+
+    @staticmethod
+    def key(token: str) -> bytes:
+        return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+    def get(self, token: str) -> Optional[dict]:
+        key = self.key(token)
+        claims = self._entries.get(key)
+        if claims is None:
+            return None
+        if claims["exp"] <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return claims
+
+    def set(self, token: str, claims: dict):
+        # Tokens without an expiry are verified every time
+        if "exp" not in claims:
+            return
+        key = self.key(token)
+        self._entries[key] = claims
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+token_cache = TokenCache(max_entries=settings.jwt_cache_max_entries)
+
+
+def _create_token(data: dict, token_type: str, expires_delta: timedelta) -> str:
+    from jose import jwt
+
+    claims = dict(data)
+    claims.setdefault("type", token_type)
+    claims["exp"] = datetime.now(timezone.utc) + expires_delta
+    return jwt.encode(claims, settings.jwt_secret_key, algorithm=settings.jwt_algorithm)
+
+
+def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
+    return _create_token(
+        data,
+        ACCESS_TOKEN,
+        expires_delta or timedelta(minutes=settings.access_token_expire_minutes),
+    )
+
+
+def create_refresh_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
+    return _create_token(
+        data,
+        REFRESH_TOKEN,
+        expires_delta or timedelta(days=settings.refresh_token_expire_days),
+    )
+
+
+def decode_token(token: str, token_type: str = ACCESS_TOKEN) -> dict:
+    claims = token_cache.get(token)
+    if claims is None:
+        # python-jose is only imported once a token has to be verified
+        from jose import JWTError, jwt
+
+        try:
+            claims = jwt.decode(
+                token, settings.jwt_secret_key, algorithms=[settings.jwt_algorithm]
+            )
+        except JWTError as e:
+            raise InvalidToken(str(e)) from e
+        if "sub" not in claims:
+            raise InvalidToken("Token has no subject")
+        token_cache.set(token, claims)
+    if claims.get("type", ACCESS_TOKEN) != token_type:
+        raise InvalidToken(f"Expected a {token_type} token")
+    return claims
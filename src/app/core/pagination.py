@@ -0,0 +1,43 @@
+# pagination.py
+import base64
+import binascii
+
+import orjson
+from sqlalchemy import tuple_
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+# Cursors are opaque to clients: the sort key of the last row they received
+def encode_cursor(*values) -> str:
+    return base64.urlsafe_b64encode(orjson.dumps(values)).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: str, size: int = 1) -> list:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = orjson.loads(base64.urlsafe_b64decode(padded))
+    except (binascii.Error, orjson.JSONDecodeError, ValueError):
+        raise InvalidCursor("Invalid pagination cursor.")
+    if not isinstance(values, list) or len(values) != size:
+        raise InvalidCursor("Invalid pagination cursor.")
+    return values
+
+
+# Keyset pagination: seek past the last key instead of using OFFSET, so every
+# page is an index range scan no matter how deep it is. One extra row is
+# fetched to know whether another page follows.
+async def keyset_page(db, stmt, keys, limit: int, after=None):
+    if after is not None:
+        stmt = stmt.where(tuple_(*keys) > tuple_(*after))
+    rows = (await db.scalars(stmt.order_by(*keys).limit(limit + 1))).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(*(getattr(rows[-1], key.key) for key in keys))
+    return rows, next_cursor
@@ -0,0 +1,64 @@
+# responses.py
+import csv
+import io
+from typing import AsyncIterator, Iterable, Sequence, Type
+
+import orjson
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel
+
+
+def encode_json(content) -> bytes:
+    return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+class ORJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return encode_json(content)
+
+
+class RawJSONResponse(Response):
+    # Body is already encoded JSON
+    media_type = "application/json"
+
+
+def row_to_dict(row, schema: Type[BaseModel]) -> dict:
+    return {name: getattr(row, name) for name in schema.model_fields}
+
+
+# Encode ORM rows straight to JSON bytes using the schema's field names. The
+# rows come from our own tables, so the schema validation pass is skipped.
+def encode_row(row, schema: Type[BaseModel]) -> bytes:
+    return orjson.dumps(row_to_dict(row, schema))
+
+
+def rows_to_dicts(rows: Iterable, schema: Type[BaseModel]) -> list:
+    fields = tuple(schema.model_fields)
+    return [{name: getattr(row, name) for name in fields} for row in rows]
+
+
+def encode_rows(rows: Iterable, schema: Type[BaseModel]) -> bytes:
+    return orjson.dumps(rows_to_dicts(rows, schema))
+
+
+# Streaming encoders. Each partition of rows becomes one chunk of the body,
+# so memory stays bounded by the partition size rather than the result size.
+async def ndjson_stream(partitions: AsyncIterator, fields: Sequence[str]):
+    async for rows in partitions:
+        yield b"".join(
+            orjson.dumps(dict(zip(fields, row)), option=orjson.OPT_APPEND_NEWLINE)
+            for row in rows
+        )
+
+
+async def csv_stream(partitions: AsyncIterator, fields: Sequence[str]):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    async for rows in partitions:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
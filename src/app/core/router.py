@@ -0,0 +1,31 @@
+# router.py
+#
+# Collects route declarations at import time and registers them when the app
+# is built. Building a FastAPI route analyses its signature and models, which
+# is the bulk of the app's own import cost; deferring it to create_app() keeps
+# `import app.main` cheap for tools that never serve requests.
+from typing import Any, Callable, List, Tuple
+
+from fastapi import FastAPI
+
+
+class DeferredRouter:
+    def __init__(self):
+        self.routes: List[Tuple[str, Callable, List[str], dict]] = []
+
+    def api_route(self, path: str, methods: List[str], **kwargs: Any):
+        def decorator(endpoint: Callable) -> Callable:
+            self.routes.append((path, endpoint, methods, kwargs))
+            return endpoint
+
+        return decorator
+
+    def get(self, path: str, **kwargs: Any):
+        return self.api_route(path, ["GET"], **kwargs)
+
+    def post(self, path: str, **kwargs: Any):
+        return self.api_route(path, ["POST"], **kwargs)
+
+    def include_in(self, app: FastAPI):
+        for path, endpoint, methods, kwargs in self.routes:
+            app.add_api_route(path, endpoint, methods=methods, **kwargs)
@@ -0,0 +1,158 @@
+# security.py
+import argparse
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+
+from app.core.config import settings
+
+BCRYPT_MIN_ROUNDS = 4
+BCRYPT_MAX_ROUNDS = 20
+
+
+def _context_config(rounds=None) -> dict:
+    config = {"schemes": ["bcrypt"], "deprecated": "auto"}
+    if rounds is not None:
+        # needs_update() flags hashes at any other cost, so the cost can move
+        # in either direction. Every worker runs the same BCRYPT_ROUNDS, so
+        # no hash is rehashed back and forth.
+        config.update(
+            bcrypt__default_rounds=rounds,
+            bcrypt__min_rounds=rounds,
+            bcrypt__max_rounds=rounds,
+        )
+    return config
+
+
+def _crypt_context(rounds=None):
+    # passlib and the bcrypt backend are imported on first use, not with the app
+    from passlib.context import CryptContext
+
+    return CryptContext(**_context_config(rounds))
+
+
+# Password hashing
+@lru_cache(maxsize=None)
+def get_pwd_context():
+    return _crypt_context(settings.bcrypt_rounds)
+
+
+class HashingPoolBusy(Exception):
+    pass
+
+
+# Executed inside the worker processes
+def _init_worker(rounds):
+    get_pwd_context().load(_context_config(rounds))
+
+
+def _hash(password: str) -> str:
+    return get_pwd_context().hash(password)
+
+
+def _verify(password: str, hashed_password: str) -> bool:
+    return get_pwd_context().verify(password, hashed_password)
+
+
+def calibrate_bcrypt_rounds(target_ms: float, samples: int = 3) -> int:
+    # Each extra round doubles the cost, so stop at the first one over budget
+    rounds = BCRYPT_MIN_ROUNDS
+    for candidate in range(BCRYPT_MIN_ROUNDS, BCRYPT_MAX_ROUNDS + 1):
+        context = _crypt_context(candidate)
+        elapsed = []
+        for _ in range(samples):
+            start = time.perf_counter()
+            context.hash("calibration-password")
+            elapsed.append((time.perf_counter() - start) * 1000)
+        if min(elapsed) > target_ms:
+            break
+        rounds = candidate
+    return rounds
+
+
+class PasswordHasher:
+    """Runs CryptContext operations off the event loop.
+
+    bcrypt is CPU bound, so hashing inline blocks every other request served
+    by the worker. Calls are handed to a dedicated process pool instead, and
+    once ``max_pending`` calls are queued new ones fail fast with
+    ``HashingPoolBusy`` rather than piling up behind a login burst. A pool
+    broken by a dead worker is replaced on the next call.
+    """
+
+    def __init__(self, workers: int, max_pending: int, rounds=None):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.rounds = rounds
+        self.pending = 0
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None and self.workers > 0:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.rounds,),
+            )
+        return self._executor
+
+    async def _run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            raise HashingPoolBusy("Too many password operations in progress.")
+        self.pending += 1
+        executor = self._get_executor()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, fn, *args)
+        except BrokenProcessPool:
+            # A worker died (OOM, kill) and the pool refuses all further
+            # work: drop it so the next call spawns a fresh one
+            if self._executor is executor:
+                self._executor = None
+                executor.shutdown(wait=False, cancel_futures=True)
+            raise HashingPoolBusy("Password hashing pool restarted, retry.")
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(_hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run(_verify, password, hashed_password)
+
+    def needs_update(self, hashed_password: str) -> bool:
+        return get_pwd_context().needs_update(hashed_password)
+
+    def set_rounds(self, rounds):
+        self.rounds = rounds
+        get_pwd_context().load(_context_config(rounds))
+        # Workers are configured at spawn time, so restart them lazily
+        self.shutdown()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher(
+    workers=settings.password_hash_workers,
+    max_pending=settings.password_hash_max_pending,
+    rounds=settings.bcrypt_rounds,
+)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Find the bcrypt cost that fits the hashing latency budget."
+    )
+    parser.add_argument(
+        "--target-ms", type=float, default=settings.password_hash_target_ms
+    )
+    args = parser.parse_args()
+    rounds = calibrate_bcrypt_rounds(args.target_ms)
+    print(f"BCRYPT_ROUNDS={rounds}")
@@ -0,0 +1,37 @@
+# uploads.py
+import csv
+import io
+from typing import BinaryIO, Iterator, Tuple
+
+import orjson
+
+# Incremental readers for uploaded record files. Each yields
+# (line number, record) pairs, or (line number, exception) for lines that
+# could not be parsed, so one bad line does not abort the whole upload.
+
+
+def _text(file: BinaryIO):
+    return io.TextIOWrapper(file, encoding="utf-8", newline="")
+
+
+def iter_csv_records(file: BinaryIO) -> Iterator[Tuple[int, object]]:
+    reader = csv.DictReader(_text(file))
+    try:
+        for record in reader:
+            yield reader.line_num, record
+    except (csv.Error, UnicodeDecodeError) as e:
+        yield reader.line_num, e
+
+
+def iter_ndjson_records(file: BinaryIO) -> Iterator[Tuple[int, object]]:
+    line_number = 0
+    try:
+        for line_number, line in enumerate(_text(file), start=1):
+            if not line.strip():
+                continue
+            try:
+                yield line_number, orjson.loads(line)
+            except orjson.JSONDecodeError as e:
+                yield line_number, e
+    except UnicodeDecodeError as e:
+        yield line_number + 1, e
@@ -0,0 +1,22 @@
+# dialect.py
+from sqlalchemy.dialects import postgresql, sqlite
+
+
+def dialect_name(db) -> str:
+    return db.get_bind().dialect.name
+
+
+# INSERT construct with ON CONFLICT support for the backends we run on:
+# Postgres in deployments, SQLite in tests and local tooling
+def insert(db, table):
+    if dialect_name(db) == "postgresql":
+        return postgresql.insert(table)
+    return sqlite.insert(table)
+
+
+def supports_insert_returning(db) -> bool:
+    return db.get_bind().dialect.insert_returning
+
+
+def supports_update_returning(db) -> bool:
+    return db.get_bind().dialect.update_returning
@@ -0,0 +1,94 @@
+# pool.py
+#
+# Queue pools that keep checkout statistics. Besides what the pool already
+# knows (connections checked out, overflow in use) they count checkouts that
+# found the pool exhausted and had to wait, checkouts that timed out, and how
+# long checkouts took, so pool_size/max_overflow can be sized per worker
+# against the server's max_connections.
+import threading
+import time
+from typing import Any, Dict
+
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+
+class PoolStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.checkout_seconds = 0.0
+        self.max_checkout_seconds = 0.0
+
+    def record(self, seconds: float, waited: bool, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+                self.checkout_seconds += seconds
+                self.max_checkout_seconds = max(self.max_checkout_seconds, seconds)
+            if waited:
+                self.waits += 1
+
+
+class _InstrumentedPool:
+    stats: PoolStats
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        # Nothing idle and no overflow left: this checkout blocks until another
+        # one is returned or pool_timeout expires
+        waited = (
+            self.checkedin() == 0
+            and self._max_overflow > -1
+            and self.overflow() >= self._max_overflow
+        )
+        start = time.perf_counter()
+        try:
+            entry = super()._do_get()
+        except exc.TimeoutError:
+            self.stats.record(time.perf_counter() - start, waited, timed_out=True)
+            raise
+        self.stats.record(time.perf_counter() - start, waited)
+        return entry
+
+
+class InstrumentedQueuePool(_InstrumentedPool, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(_InstrumentedPool, AsyncAdaptedQueuePool):
+    pass
+
+
+def pool_status(pool) -> Dict[str, Any]:
+    status: Dict[str, Any] = {"pool_class": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update(
+            size=pool.size(),
+            max_overflow=pool._max_overflow,
+            timeout=pool.timeout(),
+            checked_out=pool.checkedout(),
+            checked_in=pool.checkedin(),
+            overflow=max(pool.overflow(), 0),
+        )
+    stats = getattr(pool, "stats", None)
+    if stats is not None:
+        status.update(
+            checkouts=stats.checkouts,
+            waits=stats.waits,
+            timeouts=stats.timeouts,
+            avg_checkout_ms=(
+                stats.checkout_seconds / stats.checkouts * 1000
+                if stats.checkouts
+                else 0.0
+            ),
+            max_checkout_ms=stats.max_checkout_seconds * 1000,
+        )
+    return status
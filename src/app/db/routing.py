@@ -0,0 +1,52 @@
+# routing.py
+#
+# Read-your-writes for replica reads. A successful write stamps the response
+# with a cookie holding the time until which that client's reads should stay
+# on the primary; get_read_db checks it before picking the replica.
+import math
+import time
+
+from starlette.datastructures import MutableHeaders
+from starlette.requests import Request
+
+from app.core.config import settings
+
+PRIMARY_UNTIL_COOKIE = "primary_until"
+SAFE_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+
+
+def reads_from_primary(request: Request) -> bool:
+    value = request.cookies.get(PRIMARY_UNTIL_COOKIE)
+    if value is None:
+        return False
+    try:
+        until = float(value)
+    except ValueError:
+        return False
+    # The client can send anything: a stamp further out than one window was
+    # not set by us and would pin its reads to the primary indefinitely
+    now = time.time()
+    return now < until <= now + settings.read_your_writes_window
+
+
+class ReadYourWritesMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        window = settings.read_your_writes_window
+        if scope["type"] != "http" or scope["method"] in SAFE_METHODS or window <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                until = time.time() + window
+                MutableHeaders(scope=message).append(
+                    "set-cookie",
+                    f"{PRIMARY_UNTIL_COOKIE}={until:.3f}; Max-Age={math.ceil(window)}; "
+                    "Path=/; HttpOnly; SameSite=Lax",
+                )
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
@@ -1,21 +1,136 @@
 # database.py
+from functools import lru_cache
+
+from fastapi import Request
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-DATABASE_URL = "postgresql+psycopg2://app_user:app_password@db/app"
+from app.core.config import settings
+from app.db.pool import InstrumentedAsyncQueuePool, InstrumentedQueuePool
+from app.db.routing import reads_from_primary
+
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+
+def to_async_url(url: str) -> str:
+    url = make_url(url)
+    drivername = ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername)
+    return url.set(drivername=drivername).render_as_string(hide_password=False)
+
+
+def pool_options() -> dict:
+    return {
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+    }
+
+
+DATABASE_URL = settings.database_url
+ASYNC_DATABASE_URL = settings.async_database_url or to_async_url(DATABASE_URL)
+REPLICA_DATABASE_URL = (
+    to_async_url(settings.replica_database_url)
+    if settings.replica_database_url
+    else None
+)
+
+# Engines and session factories are built on first use, so importing the
+# models or the app does not load the database drivers.
+
+
+# Sync engine, kept for alembic and command line tools
+@lru_cache(maxsize=None)
+def get_engine():
+    return create_engine(
+        DATABASE_URL, poolclass=InstrumentedQueuePool, **pool_options()
+    )
+
+
+@lru_cache(maxsize=None)
+def get_sessionmaker():
+    return sessionmaker(autocommit=False, autoflush=False, bind=get_engine())
+
+
+# Async engine used by the API
+@lru_cache(maxsize=None)
+def get_async_engine():
+    return create_async_engine(
+        ASYNC_DATABASE_URL, poolclass=InstrumentedAsyncQueuePool, **pool_options()
+    )
+
+
+# Engine for GET endpoints; the primary itself when no replica is configured
+@lru_cache(maxsize=None)
+def get_read_async_engine():
+    if REPLICA_DATABASE_URL is None:
+        return get_async_engine()
+    return create_async_engine(
+        REPLICA_DATABASE_URL, poolclass=InstrumentedAsyncQueuePool, **pool_options()
+    )
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def _async_sessionmaker(engine):
+    return async_sessionmaker(
+        bind=engine,
+        class_=AsyncSession,
+        autoflush=False,
+        expire_on_commit=False,
+    )
+
+
+@lru_cache(maxsize=None)
+def primary_sessionmaker():
+    return _async_sessionmaker(get_async_engine())
+
+
+@lru_cache(maxsize=None)
+def read_sessionmaker():
+    return _async_sessionmaker(get_read_async_engine())
+
+
+async def dispose_engines():
+    for factory in (get_read_async_engine, get_async_engine):
+        if factory.cache_info().currsize:
+            await factory().dispose()
+    if get_engine.cache_info().currsize:
+        get_engine().dispose()
 
 
 # Dependency
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with primary_sessionmaker()() as db:
         yield db
-    finally:
-        db.close()
+
+
+# Dependency for read-only handlers. Clients that wrote recently stay on the
+# primary so they read their own writes.
+async def get_read_db(request: Request):
+    factory = primary_sessionmaker if reads_from_primary(request) else read_sessionmaker
+    async with factory()() as db:
+        yield db
+
+
+_LAZY_ATTRIBUTES = {
+    "engine": get_engine,
+    "SessionLocal": get_sessionmaker,
+    "async_engine": get_async_engine,
+    "read_async_engine": get_read_async_engine,
+    "AsyncSessionLocal": primary_sessionmaker,
+    "ReadSessionLocal": read_sessionmaker,
+}
+
+
+# Keep `from app.db.session import engine` and friends working
+def __getattr__(name):
+    try:
+        return _LAZY_ATTRIBUTES[name]()
+    except KeyError:
+        raise AttributeError(name) from None
 
 
 Base = declarative_base()
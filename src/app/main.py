@@ -1,10 +1,67 @@
-from fastapi import FastAPI, Depends, HTTPException
-from fastapi.responses import JSONResponse
+import asyncio
+from collections import Counter
+from contextlib import asynccontextmanager, suppress
 
-from sqlalchemy.orm import Session
-from app.db.session import get_db
-from typing import List
+from fastapi import (
+    Body,
+    FastAPI,
+    Depends,
+    HTTPException,
+    Query,
+    Request,
+    UploadFile,
+)
+from fastapi.responses import Response, StreamingResponse
+
+from sqlalchemy import exc, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.admission import AdmissionMiddleware, admission
+from app.core.auth import (
+    Identity,
+    bearer_scheme,
+    get_current_identity,
+    token_identity,
+)
+from app.core.cache import etag_matches, make_etag
+from app.core.config import settings
+from app.core.jwt import REFRESH_TOKEN, create_access_token, create_refresh_token
+from app.core.metrics import CONTENT_TYPE, MetricsMiddleware, metrics
+from app.core.router import DeferredRouter
+from app.core.pagination import (
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    InvalidCursor,
+    decode_cursor,
+)
+from app.core.responses import (
+    ORJSONResponse,
+    RawJSONResponse,
+    csv_stream,
+    ndjson_stream,
+    encode_json,
+    encode_row,
+    row_to_dict,
+    rows_to_dicts,
+)
+from app.core.security import (
+    HashingPoolBusy,
+    password_hasher,
+)
+from app.core.uploads import iter_csv_records, iter_ndjson_records
+from app.db.pool import pool_status
+from app.db.routing import ReadYourWritesMiddleware, reads_from_primary
+from app.db.session import (
+    dispose_engines,
+    get_async_engine,
+    get_db,
+    get_read_async_engine,
+    get_read_db,
+)
+from datetime import date
+from typing import List, Literal, Optional
 from app.models import User, Magazine, Plan, Subscription
+from app.pricing import PriceMatrix, price_matrix
+from app.stats import get_subscription_stats
 from app.views import (
     create_user,
     authenticate_user,
@@ -12,35 +69,79 @@ from app.views import (
     UserLogin,
     UserResponse,
     MagazineResponse,
+    MagazinePage,
+    PlanResponse,
+    PlanPage,
     SubscriptionResponse,
+    SubscriptionPage,
     SubscriptionCreate,
+    SubscriptionBulkResponse,
+    CatalogImportSummary,
+    catalog_cache,
     get_magazines,
     get_plans,
     cancel_subscription,
+    cancel_subscriptions,
+    SubscriptionCancel,
     get_active_subscriptions_for_user,
+    get_upcoming_renewals,
     create_subscription,
+    create_subscriptions_bulk,
+    stream_subscriptions,
+    import_catalog,
+    registered_users,
+    username_or_email_taken,
 )
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Build the registered-users filter through get_db so overrides apply,
+    # then keep rebuilding it in the background
+    session_factory = app.dependency_overrides.get(get_db, get_db)
+    async for db in session_factory():
+        await registered_users.load(db)
+    reloader = asyncio.create_task(
+        registered_users.reload_periodically(session_factory)
+    )
+    yield
+    reloader.cancel()
+    with suppress(asyncio.CancelledError):
+        await reloader
+    password_hasher.shutdown()
+    await dispose_engines()
+
+
+routes = DeferredRouter()
+
+
+async def hashing_pool_busy_handler(request: Request, exc: HashingPoolBusy):
+    return ORJSONResponse(
+        content={"detail": str(exc)}, status_code=503, headers={"Retry-After": "1"}
+    )
+
+
+# No connection freed up within pool_timeout: the database is saturated
+async def pool_timeout_handler(request: Request, error: exc.TimeoutError):
+    return ORJSONResponse(
+        content={"detail": "Database busy, retry later."},
+        status_code=503,
+        headers={"Retry-After": "1"},
+    )
 
 
 # User endpoints
-@app.post("/users/register", response_model=UserCreate)
-def register_user(user: UserCreate, db: Session = Depends(get_db)):
+@routes.post("/users/register", response_model=UserCreate)
+async def register_user(user: UserCreate, db: AsyncSession = Depends(get_db)):
     try:
-        # Check if the username or email already exists
-        existing_user = (
-            db.query(User)
-            .filter((User.username == user.username) | (User.email == user.email))
-            .first()
-        )
-        if existing_user:
+        # Duplicates are turned away before any bcrypt work
+        if await username_or_email_taken(db, user.username, user.email):
             raise HTTPException(
                 status_code=400, detail="Username or email already registered"
             )
 
-        db_user = create_user(db, user)
-        return JSONResponse(
+        db_user = await create_user(db, user)
+        return ORJSONResponse(
             content={
                 "message": "User created successfully",
                 "user_id": db_user.id,
@@ -48,25 +149,75 @@ def register_user(user: UserCreate, db: Session = Depends(get_db)):
             },
             status_code=201,
         )
+    except exc.IntegrityError:
+        # Lost a race, or registered through another worker since the last load
+        await db.rollback()
+        raise HTTPException(
+            status_code=400, detail="Username or email already registered"
+        )
+    except (HTTPException, HashingPoolBusy, exc.TimeoutError):
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
-@app.post("/users/login")
-def login_user(user: UserLogin, db: Session = Depends(get_db)):
-    db_user = authenticate_user(db, user.email, user.password)
+# Answered from the registered-users filter; only possible hits are looked up
+@routes.get("/users/availability")
+async def check_availability(
+    username: Optional[str] = None,
+    email: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+    if username is None and email is None:
+        raise HTTPException(status_code=400, detail="Pass a username or an email")
+    availability = {}
+    if username is not None:
+        availability["username"] = not await username_or_email_taken(
+            db, username=username
+        )
+    if email is not None:
+        availability["email"] = not await username_or_email_taken(db, email=email)
+    return availability
+
+
+@routes.post("/users/login")
+async def login_user(user: UserLogin, db: AsyncSession = Depends(get_db)):
+    db_user = await authenticate_user(db, user.email, user.password)
     if db_user:
         return {
             "message": "Login successful",
             "user_id": db_user.id,
-            "user_name": db_user.name,
+            "user_name": db_user.username,
+            **issue_tokens(Identity(username=db_user.username, user_id=db_user.id)),
         }
     raise HTTPException(status_code=401, detail="Invalid credentials")
 
 
+def issue_tokens(identity: Identity) -> dict:
+    claims = {"sub": identity.username}
+    if identity.user_id is not None:
+        claims["uid"] = identity.user_id
+    return {
+        "access_token": create_access_token(claims),
+        "refresh_token": create_refresh_token(claims),
+        "token_type": "bearer",
+    }
+
+
+@routes.post("/users/token/refresh")
+async def refresh_token(credentials=Depends(bearer_scheme)):
+    return issue_tokens(token_identity(credentials, REFRESH_TOKEN))
+
+
+# Served from the token claims, without a database round trip
+@routes.get("/users/me")
+async def read_current_user(identity: Identity = Depends(get_current_identity)):
+    return {"user_id": identity.user_id, "username": identity.username}
+
+
 #  api to reset password
-def reset_password(email: str, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == email).first()
+async def reset_password(email: str, db: AsyncSession = Depends(get_db)):
+    user = await db.scalar(select(User).where(User.email == email))
     if user:
         # Send password reset email
         return {"message": "Password reset email sent"}
@@ -74,45 +225,306 @@ def reset_password(email: str, db: Session = Depends(get_db)):
 
 
 # Magazine and plan endpoints
-@app.get("/magazines/")
-def list_magazines(db: Session = Depends(get_db)):
-    magazines = get_magazines(db)
-    plans = get_plans(db)
-    return JSONResponse(
-        content={"magazines": magazines, "plans": plans},
-        status_code=200,
+# Keyset pagination parameters shared by the listing endpoints
+def page_params(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+):
+    if cursor is None:
+        return limit, None
+    try:
+        (after_id,) = decode_cursor(cursor)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not isinstance(after_id, int):
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor.")
+    return limit, after_id
+
+
+# The cache only holds bodies read through the read database. Clients pinned
+# to the primary after a write bypass it: an entry rebuilt from a lagging
+# replica right after their write would hide that write from them.
+async def cached_catalog_response(request: Request, key: str, build):
+    if reads_from_primary(request):
+        body = await build()
+        etag = make_etag(body)
+    else:
+        cached = catalog_cache.get(key)
+        if cached is None:
+            version = catalog_cache.version
+            cached = catalog_cache.set(key, await build(), version)
+        body, etag = cached.body, cached.etag
+
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return RawJSONResponse(content=body, headers=headers)
+
+
+@routes.get("/magazines/", response_model=MagazinePage)
+async def list_magazines(
+    request: Request, page=Depends(page_params), db: AsyncSession = Depends(get_read_db)
+):
+    limit, after_id = page
+
+    async def build():
+        magazines, next_cursor = await get_magazines(db, limit, after_id)
+        return encode_json(
+            {
+                "magazines": rows_to_dicts(magazines, MagazineResponse),
+                "next_cursor": next_cursor,
+            }
+        )
+
+    return await cached_catalog_response(
+        request, f"magazines:{limit}:{after_id}", build
     )
 
 
-@app.post("/subscriptions/", response_model=SubscriptionResponse)
-def add_subscription(subscription: SubscriptionCreate, db: Session = Depends(get_db)):
+@routes.get("/plans/", response_model=PlanPage)
+async def list_plans(
+    request: Request, page=Depends(page_params), db: AsyncSession = Depends(get_read_db)
+):
+    limit, after_id = page
+
+    async def build():
+        plans, next_cursor = await get_plans(db, limit, after_id)
+        return encode_json(
+            {
+                "plans": rows_to_dicts(plans, PlanResponse),
+                "next_cursor": next_cursor,
+            }
+        )
+
+    return await cached_catalog_response(request, f"plans:{limit}:{after_id}", build)
+
+
+# Price of every magazine/plan pair: prices[i][j] is magazine_ids[i] on
+# plan_ids[j]
+@routes.get("/pricing/matrix")
+async def pricing_matrix(request: Request, db: AsyncSession = Depends(get_read_db)):
+    async def build():
+        matrix = price_matrix
+        if reads_from_primary(request):
+            # The shared matrix may have been loaded from a lagging replica
+            matrix = PriceMatrix(ttl=0)
+            await matrix.load(db)
+        else:
+            await price_matrix.ensure_loaded(db)
+        return encode_json(matrix.as_dict())
+
+    return await cached_catalog_response(request, "pricing:matrix", build)
+
+
+@routes.post("/catalog/import", response_model=CatalogImportSummary)
+async def import_catalog_endpoint(
+    file: UploadFile,
+    kind: Literal["magazines", "plans"],
+    import_format: Literal["csv", "ndjson"] = Query("csv", alias="format"),
+    db: AsyncSession = Depends(get_db),
+):
+    # The upload is already spooled to a temporary file, so reading it here
+    # does not wait on the network
+    reader = iter_csv_records if import_format == "csv" else iter_ndjson_records
+    return await import_catalog(db, kind, reader(file.file))
+
+
+@routes.post("/subscriptions/", response_model=SubscriptionResponse)
+async def add_subscription(
+    subscription: SubscriptionCreate, db: AsyncSession = Depends(get_db)
+):
     try:
         # Create a new subscription
-        return create_subscription(db=db, subscription=subscription)
+        db_subscription = await create_subscription(db=db, subscription=subscription)
+        return RawJSONResponse(encode_row(db_subscription, SubscriptionResponse))
     except ValueError as e:
         # Handle errors such as duplicate subscriptions or invalid references
         raise HTTPException(status_code=400, detail=str(e))
 
 
-@app.get("/subscriptions/{user_id}/", response_model=List[SubscriptionResponse])
-def get_subscriptions(user_id: int, db: Session = Depends(get_db)):
+@routes.post("/subscriptions/bulk", response_model=SubscriptionBulkResponse)
+async def add_subscriptions_bulk(
+    subscriptions: List[SubscriptionCreate] = Body(
+        ..., min_length=1, max_length=settings.bulk_subscription_max_items
+    ),
+    db: AsyncSession = Depends(get_db),
+):
+    # Items succeed or fail individually; the batch itself is one transaction
+    results = await create_subscriptions_bulk(db, subscriptions)
+    for index, result in enumerate(results):
+        result["index"] = index
+        if "subscription" in result:
+            result["subscription"] = row_to_dict(
+                result["subscription"], SubscriptionResponse
+            )
+    counts = Counter(result["status"] for result in results)
+    return RawJSONResponse(
+        encode_json(
+            {
+                "created": counts["created"],
+                "conflicts": counts["conflict"],
+                "invalid": counts["invalid"],
+                "results": results,
+            }
+        )
+    )
+
+
+@routes.post("/subscriptions/cancel")
+async def cancel_subscriptions_endpoint(
+    target: SubscriptionCancel, db: AsyncSession = Depends(get_db)
+):
+    cancelled = await cancel_subscriptions(
+        db,
+        subscription_ids=target.subscription_ids,
+        user_id=target.user_id,
+        magazine_id=target.magazine_id,
+    )
+    return {"cancelled": cancelled, "count": len(cancelled)}
+
+
+@routes.get("/subscriptions/export")
+async def export_subscriptions(
+    export_format: Literal["ndjson", "csv"] = Query("ndjson", alias="format"),
+    is_active: Optional[bool] = None,
+    magazine_id: Optional[int] = None,
+    renewal_from: Optional[date] = None,
+    renewal_to: Optional[date] = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+    partitions = stream_subscriptions(
+        db,
+        is_active=is_active,
+        magazine_id=magazine_id,
+        renewal_from=renewal_from,
+        renewal_to=renewal_to,
+    )
+    fields = tuple(SubscriptionResponse.model_fields)
+    if export_format == "csv":
+        return StreamingResponse(
+            csv_stream(partitions, fields),
+            media_type="text/csv",
+            headers={"Content-Disposition": 'attachment; filename="subscriptions.csv"'},
+        )
+    return StreamingResponse(
+        ndjson_stream(partitions, fields), media_type="application/x-ndjson"
+    )
+
+
+# Active subscriptions renewing between from and to (inclusive), in renewal
+# date order
+@routes.get("/subscriptions/renewals", response_model=SubscriptionPage)
+async def upcoming_renewals(
+    renewal_to: date = Query(..., alias="to"),
+    renewal_from: Optional[date] = Query(None, alias="from"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+    after = None
+    if cursor is not None:
+        try:
+            renewal_date, after_id = decode_cursor(cursor, size=2)
+            if not isinstance(renewal_date, str) or not isinstance(after_id, int):
+                raise InvalidCursor("Invalid pagination cursor.")
+            after = (date.fromisoformat(renewal_date), after_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid pagination cursor.")
+    subscriptions, next_cursor = await get_upcoming_renewals(
+        db, renewal_from or date.today(), renewal_to, limit, after
+    )
+    return RawJSONResponse(
+        encode_json(
+            {
+                "subscriptions": rows_to_dicts(subscriptions, SubscriptionResponse),
+                "next_cursor": next_cursor,
+            }
+        )
+    )
+
+
+@routes.get("/subscriptions/{user_id}/", response_model=SubscriptionPage)
+async def get_subscriptions(
+    user_id: int, page=Depends(page_params), db: AsyncSession = Depends(get_read_db)
+):
+    limit, after_id = page
     try:
         # Retrieve active subscriptions for the user
-        subscriptions = get_active_subscriptions_for_user(db, user_id)
-        return subscriptions
+        subscriptions, next_cursor = await get_active_subscriptions_for_user(
+            db, user_id, limit, after_id
+        )
+        return RawJSONResponse(
+            encode_json(
+                {
+                    "subscriptions": rows_to_dicts(subscriptions, SubscriptionResponse),
+                    "next_cursor": next_cursor,
+                }
+            )
+        )
+    except exc.TimeoutError:
+        raise
     except Exception as e:
         return HTTPException(status_code=400, detail=str(e))
 
 
-@app.post("/subscriptions/{subscription_id}/cancel/")
-def cancel_subscription_endpoint(subscription_id: int, db: Session = Depends(get_db)):
+@routes.post("/subscriptions/{subscription_id}/cancel/")
+async def cancel_subscription_endpoint(
+    subscription_id: int, db: AsyncSession = Depends(get_db)
+):
     try:
         # Cancel the specified subscription
-        subscription = cancel_subscription(db, subscription_id)
+        subscription = await cancel_subscription(db, subscription_id)
         if subscription is None:
             raise HTTPException(status_code=404, detail="Subscription not found")
-        return JSONResponse(
+        return ORJSONResponse(
             content={"message": "Subscription cancelled"}, status_code=200
         )
+    except (HTTPException, exc.TimeoutError):
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+
+
+# Active subscribers, revenue and MRR per magazine and plan, read from the
+# maintained summary rather than aggregated over subscriptions
+@routes.get("/stats/subscriptions")
+async def subscription_stats(db: AsyncSession = Depends(get_read_db)):
+    return RawJSONResponse(encode_json(await get_subscription_stats(db)))
+
+
+# Operational endpoints
+@routes.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    return Response(
+        content=metrics.render() + admission.render(), media_type=CONTENT_TYPE
+    )
+
+
+@routes.get("/db/pool")
+async def db_pool_stats():
+    primary, replica = get_async_engine(), get_read_async_engine()
+    stats = {"primary": pool_status(primary.pool)}
+    if replica is not primary:
+        stats["replica"] = pool_status(replica.pool)
+    return stats
+
+
+def create_app() -> FastAPI:
+    app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+    app.add_middleware(ReadYourWritesMiddleware)
+    app.add_middleware(AdmissionMiddleware)
+    app.add_middleware(MetricsMiddleware)
+    app.add_exception_handler(HashingPoolBusy, hashing_pool_busy_handler)
+    app.add_exception_handler(exc.TimeoutError, pool_timeout_handler)
+    routes.include_in(app)
+    return app
+
+
+# `uvicorn app.main:app` and `from app.main import app` build the app on first
+# access; `uvicorn --factory app.main:create_app` builds it explicitly.
+def __getattr__(name):
+    if name == "app":
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,5 +1,16 @@
 # models.py
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, Date, Boolean
+from sqlalchemy import (
+    Column,
+    Integer,
+    String,
+    Float,
+    ForeignKey,
+    Date,
+    DateTime,
+    Boolean,
+    Index,
+    text,
+)
 from sqlalchemy.orm import relationship
 from app.db.session import Base
 
@@ -38,6 +49,11 @@ class Plan(Base):
     }
 
 
+# Predicate of the partial indexes over active subscriptions. ON CONFLICT
+# clauses targeting those indexes must repeat it verbatim.
+ACTIVE_SUBSCRIPTION = text("is_active")
+
+
 class Subscription(Base):
     __tablename__ = "subscriptions"
 
@@ -48,12 +64,48 @@ class Subscription(Base):
     price = Column(Float, nullable=False)
     renewal_date = Column(Date, nullable=False)
     is_active = Column(Boolean, default=True, nullable=False)
+    # Renewal work claims on databases without SKIP LOCKED (see app.renewals)
+    lease_owner = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime(timezone=True), nullable=True)
 
     user = relationship("User")
     magazine = relationship("Magazine")
     plan = relationship("Plan")
 
+    __table_args__ = (
+        # A user holds at most one active subscription per magazine and plan
+        Index(
+            "uq_subscriptions_active_user_magazine_plan",
+            "user_id",
+            "magazine_id",
+            "plan_id",
+            unique=True,
+            postgresql_where=ACTIVE_SUBSCRIPTION,
+            sqlite_where=ACTIVE_SUBSCRIPTION,
+        ),
+        Index("ix_subscriptions_user_id_is_active", "user_id", "is_active"),
+        # Upcoming renewals, in keyset order
+        Index(
+            "ix_subscriptions_active_renewal_date",
+            "renewal_date",
+            "id",
+            postgresql_where=ACTIVE_SUBSCRIPTION,
+            sqlite_where=ACTIVE_SUBSCRIPTION,
+        ),
+    )
+
     # Ensure price is always greater than zero
     __mapper_args__ = {
         "eager_defaults": True,
     }
+
+
+# Active subscriber count and summed price per magazine and plan, maintained
+# by the transactions that create, cancel and renew subscriptions (app.stats)
+class SubscriptionStats(Base):
+    __tablename__ = "subscription_stats"
+
+    magazine_id = Column(Integer, ForeignKey("magazines.id"), primary_key=True)
+    plan_id = Column(Integer, ForeignKey("plans.id"), primary_key=True)
+    active_count = Column(Integer, nullable=False, default=0)
+    active_revenue = Column(Float, nullable=False, default=0)
@@ -0,0 +1,160 @@
+# pricing.py
+#
+# Price of every magazine/plan pair, base_price * (1 - discount), kept per
+# worker as a NumPy matrix (one row per magazine, one column per plan). A full
+# build is a single outer product; committed changes to a base_price or a
+# discount rewrite one row or column, and new or deleted catalog rows add or
+# drop one. Writes made by other workers are picked up when the matrix
+# expires, after the same TTL as the catalog cache. That staleness is fine for
+# showing prices; subscriptions are always priced from the database.
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.models import Magazine, Plan
+
+MAGAZINE = "magazine"
+PLAN = "plan"
+
+
+class PriceMatrix:
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.magazine_ids: List[int] = []
+        self.plan_ids: List[int] = []
+        self._rows: Dict[int, int] = {}
+        self._columns: Dict[int, int] = {}
+        self.base_prices = None
+        self.discounts = None
+        self.prices = None
+        # Bumped on every change, so a load racing with one is not trusted
+        self.version = 0
+        self.expires_at: Optional[float] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.expires_at is not None and self.expires_at > time.monotonic()
+
+    async def ensure_loaded(self, db: AsyncSession):
+        if not self.loaded:
+            await self.load(db)
+
+    async def load(self, db: AsyncSession):
+        version = self.version
+        magazines = (
+            await db.execute(
+                select(Magazine.id, Magazine.base_price).order_by(Magazine.id)
+            )
+        ).all()
+        plans = (
+            await db.execute(select(Plan.id, Plan.discount).order_by(Plan.id))
+        ).all()
+        self.build(magazines, plans)
+        if self.version != version:
+            # A change committed while we were reading may be missing
+            self.expires_at = None
+
+    def build(
+        self, magazines: Iterable[Tuple[int, float]], plans: Iterable[Tuple[int, float]]
+    ):
+        import numpy as np
+
+        magazines, plans = list(magazines), list(plans)
+        self.magazine_ids = [magazine_id for magazine_id, _ in magazines]
+        self.plan_ids = [plan_id for plan_id, _ in plans]
+        self._index()
+        self.base_prices = np.array([price for _, price in magazines], dtype=float)
+        self.discounts = np.array([discount for _, discount in plans], dtype=float)
+        self.prices = np.outer(self.base_prices, 1 - self.discounts)
+        self.expires_at = time.monotonic() + self.ttl
+
+    def _index(self):
+        self._rows = {magazine_id: i for i, magazine_id in enumerate(self.magazine_ids)}
+        self._columns = {plan_id: j for j, plan_id in enumerate(self.plan_ids)}
+
+    def set_base_price(self, magazine_id: int, base_price: float):
+        import numpy as np
+
+        row = base_price * (1 - self.discounts)
+        i = self._rows.get(magazine_id)
+        if i is None:
+            self.magazine_ids.append(magazine_id)
+            self._rows[magazine_id] = len(self.magazine_ids) - 1
+            self.base_prices = np.append(self.base_prices, base_price)
+            self.prices = np.vstack([self.prices, row])
+        else:
+            self.base_prices[i] = base_price
+            self.prices[i, :] = row
+
+    def set_discount(self, plan_id: int, discount: float):
+        import numpy as np
+
+        column = self.base_prices * (1 - discount)
+        j = self._columns.get(plan_id)
+        if j is None:
+            self.plan_ids.append(plan_id)
+            self._columns[plan_id] = len(self.plan_ids) - 1
+            self.discounts = np.append(self.discounts, discount)
+            self.prices = np.column_stack([self.prices, column])
+        else:
+            self.discounts[j] = discount
+            self.prices[:, j] = column
+
+    def remove(self, kind: str, entity_id: int):
+        import numpy as np
+
+        if kind == MAGAZINE and entity_id in self._rows:
+            i = self._rows[entity_id]
+            del self.magazine_ids[i]
+            self.base_prices = np.delete(self.base_prices, i)
+            self.prices = np.delete(self.prices, i, axis=0)
+        elif kind == PLAN and entity_id in self._columns:
+            j = self._columns[entity_id]
+            del self.plan_ids[j]
+            self.discounts = np.delete(self.discounts, j)
+            self.prices = np.delete(self.prices, j, axis=1)
+        self._index()
+
+    def apply(self, changes: Dict[Tuple[str, int], Optional[float]]):
+        """Apply committed catalog changes: (kind, id) -> new base_price or
+        discount, or None for a deleted row."""
+        self.version += 1
+        if not self.loaded:
+            return
+        for (kind, entity_id), value in changes.items():
+            if value is None:
+                self.remove(kind, entity_id)
+            elif kind == MAGAZINE:
+                self.set_base_price(entity_id, value)
+            else:
+                self.set_discount(entity_id, value)
+
+    def invalidate(self):
+        self.version += 1
+        self.expires_at = None
+
+    def lookup(self, pairs: Iterable[Tuple[int, int]]) -> Dict[Tuple[int, int], float]:
+        # Pairs with a magazine or plan unknown to the matrix are left out
+        known = [
+            (magazine_id, plan_id)
+            for magazine_id, plan_id in pairs
+            if magazine_id in self._rows and plan_id in self._columns
+        ]
+        if not known:
+            return {}
+        rows = [self._rows[magazine_id] for magazine_id, _ in known]
+        columns = [self._columns[plan_id] for _, plan_id in known]
+        return dict(zip(known, self.prices[rows, columns].tolist()))
+
+    def as_dict(self) -> dict:
+        return {
+            "magazine_ids": list(self.magazine_ids),
+            "plan_ids": list(self.plan_ids),
+            "prices": self.prices.tolist(),
+        }
+
+
+price_matrix = PriceMatrix(ttl=settings.catalog_cache_ttl)
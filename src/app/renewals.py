@@ -0,0 +1,222 @@
+# renewals.py
+#
+# Batch renewal of due subscriptions, meant to run next to the API:
+#
+#   python -m app.renewals --processes 4 --chunk-size 500
+#
+# Every process claims chunks of due, active subscriptions, advances their
+# renewal_date by the plan's renewal_period (months), reprices them from the
+# current magazine and plan, and commits the chunk. Claims never overlap, so
+# throughput grows with the number of processes until the database saturates.
+import argparse
+import calendar
+import multiprocessing
+import os
+import uuid
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import bindparam, create_engine, select, update
+from sqlalchemy.orm import Session
+
+from app.db.session import DATABASE_URL
+from app.models import Magazine, Plan, Subscription
+from app.stats import stats_upsert
+
+DEFAULT_CHUNK_SIZE = 500
+# A lease outlives a crashed worker by at most this long
+LEASE_TTL = timedelta(minutes=5)
+
+
+def add_months(day: date, months: int) -> date:
+    month_index = day.month - 1 + months
+    year = day.year + month_index // 12
+    month = month_index % 12 + 1
+    return date(year, month, min(day.day, calendar.monthrange(year, month)[1]))
+
+
+def _due_rows(as_of: date):
+    return (
+        select(
+            Subscription.id,
+            Subscription.magazine_id,
+            Subscription.plan_id,
+            Subscription.price,
+            Subscription.renewal_date,
+            Plan.renewal_period,
+            Magazine.base_price,
+            Plan.discount,
+        )
+        .join(Plan, Plan.id == Subscription.plan_id)
+        .join(Magazine, Magazine.id == Subscription.magazine_id)
+        .where(Subscription.is_active == True, Subscription.renewal_date <= as_of)
+        .order_by(Subscription.id)
+    )
+
+
+# Postgres: lock the chunk for the length of the transaction. Rows locked by
+# other workers are skipped instead of waited on.
+def _claim_locked(db: Session, as_of: date, chunk_size: int, worker_id: str):
+    return db.execute(
+        _due_rows(as_of)
+        .limit(chunk_size)
+        .with_for_update(skip_locked=True, of=Subscription)
+    ).all()
+
+
+# SQLite has no row locks: take a lease on the chunk in its own short
+# transaction, then work on the rows that carry our lease.
+def _claim_leased(db: Session, as_of: date, chunk_size: int, worker_id: str):
+    while True:
+        now = datetime.now(timezone.utc)
+        # Only rows _due_rows can join are claimed: a row whose plan or
+        # magazine is gone (SQLite does not enforce foreign keys by default)
+        # would be leased but never returned
+        claimable = (
+            _due_rows(as_of)
+            .with_only_columns(Subscription.id)
+            .where(
+                (Subscription.lease_expires_at == None)
+                | (Subscription.lease_expires_at < now)
+                # Rows of a chunk we rolled back are still leased to us
+                | (Subscription.lease_owner == worker_id)
+            )
+            .limit(chunk_size)
+        )
+        claimed = db.execute(
+            update(Subscription)
+            .where(Subscription.id.in_(claimable))
+            .values(lease_owner=worker_id, lease_expires_at=now + LEASE_TTL)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.commit()
+        if not claimed:
+            return []
+        # Open the work transaction with a write to our own lease: it takes
+        # the database write lock, so the rows still leased to us (none, if
+        # the lease expired and another worker took them) stay ours until
+        # the chunk commits
+        db.execute(
+            update(Subscription)
+            .where(Subscription.lease_owner == worker_id)
+            .values(lease_expires_at=datetime.now(timezone.utc) + LEASE_TTL)
+            .execution_options(synchronize_session=False)
+        )
+        rows = db.execute(
+            _due_rows(as_of).where(Subscription.lease_owner == worker_id)
+        ).all()
+        if rows:
+            return rows
+        # Whatever we hold stopped being due after it was claimed: let it go
+        db.execute(
+            update(Subscription)
+            .where(Subscription.lease_owner == worker_id)
+            .values(lease_owner=None, lease_expires_at=None)
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+
+
+def renew_due_subscriptions(
+    engine,
+    as_of: date,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    worker_id: Optional[str] = None,
+) -> int:
+    worker_id = worker_id or f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    subscriptions = Subscription.__table__
+    renew = (
+        update(subscriptions)
+        .where(subscriptions.c.id == bindparam("subscription_id"))
+        .values(
+            renewal_date=bindparam("next_renewal_date"),
+            price=bindparam("next_price"),
+            lease_owner=None,
+            lease_expires_at=None,
+        )
+    )
+    if engine.dialect.name == "postgresql":
+        claim = _claim_locked
+        # Locked rows are always updated
+        verify_rowcount = False
+    else:
+        claim = _claim_leased
+        # Leave rows alone if our lease expired and another worker took them
+        renew = renew.where(subscriptions.c.lease_owner == worker_id)
+        verify_rowcount = engine.dialect.supports_sane_multi_rowcount
+    renewed = 0
+    with Session(engine) as db:
+        while True:
+            rows = claim(db, as_of, chunk_size, worker_id)
+            if not rows:
+                db.rollback()
+                return renewed
+            renewals = [
+                {
+                    "subscription_id": row.id,
+                    "next_renewal_date": add_months(
+                        row.renewal_date, max(row.renewal_period, 1)
+                    ),
+                    "next_price": row.base_price * (1 - row.discount),
+                }
+                for row in rows
+            ]
+            updated = db.execute(renew, renewals).rowcount
+            if verify_rowcount and updated != len(rows):
+                # Some rows were no longer ours: count and reprice nothing
+                # from this chunk; whatever is still due is claimed again
+                db.rollback()
+                continue
+            # Repricing moves the active revenue of the chunk's pairs
+            repricing = defaultdict(float)
+            for row, renewal in zip(rows, renewals):
+                repricing[(row.magazine_id, row.plan_id)] += (
+                    renewal["next_price"] - row.price
+                )
+            stats = stats_upsert(
+                db, {key: (0, delta) for key, delta in repricing.items()}
+            )
+            if stats is not None:
+                db.execute(stats)
+            db.commit()
+            renewed += len(rows)
+
+
+def _worker(database_url: str, as_of: date, chunk_size: int) -> int:
+    engine = create_engine(database_url)
+    try:
+        return renew_due_subscriptions(engine, as_of, chunk_size)
+    finally:
+        engine.dispose()
+
+
+def run(
+    database_url: str,
+    as_of: date,
+    processes: int = 1,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> int:
+    if processes == 1:
+        return _worker(database_url, as_of, chunk_size)
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(processes) as pool:
+        return sum(
+            pool.starmap(_worker, [(database_url, as_of, chunk_size)] * processes)
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Renew due subscriptions.")
+    parser.add_argument("--database-url", default=DATABASE_URL)
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument(
+        "--as-of",
+        type=date.fromisoformat,
+        default=date.today(),
+        help="Renew subscriptions due on or before this date (YYYY-MM-DD).",
+    )
+    args = parser.parse_args()
+    renewed = run(args.database_url, args.as_of, args.processes, args.chunk_size)
+    print(f"Renewed {renewed} subscriptions due by {args.as_of.isoformat()}")
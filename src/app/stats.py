@@ -0,0 +1,167 @@
+# stats.py
+#
+# Active subscribers and revenue per magazine and plan. Every transaction that
+# creates, cancels or reprices subscriptions also upserts its per-pair deltas
+# into subscription_stats, so reading the stats costs O(magazines x plans)
+# rows however many subscriptions there are. Anything that writes
+# subscriptions some other way makes the table drift; a periodic
+#
+#   python -m app.stats
+#
+# recomputes it from subscriptions and corrects the rows that disagree.
+import argparse
+from collections import defaultdict
+from typing import Dict, Iterable, Tuple
+
+from sqlalchemy import create_engine, func, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.db import dialect
+from app.db.session import DATABASE_URL
+from app.models import Plan, Subscription, SubscriptionStats
+
+# (magazine_id, plan_id) -> (change in active_count, change in active_revenue)
+StatsDeltas = Dict[Tuple[int, int], Tuple[int, float]]
+
+# Revenue is a float sum; differences below this are rounding, not drift
+REVENUE_TOLERANCE = 1e-6
+
+
+def stats_deltas(rows: Iterable[Tuple[int, int, float]], sign: int = 1) -> StatsDeltas:
+    """Deltas for subscriptions (magazine_id, plan_id, price) becoming active
+    (sign=1) or inactive (sign=-1)."""
+    deltas = defaultdict(lambda: (0, 0.0))
+    for magazine_id, plan_id, price in rows:
+        count, revenue = deltas[(magazine_id, plan_id)]
+        deltas[(magazine_id, plan_id)] = (count + sign, revenue + sign * price)
+    return dict(deltas)
+
+
+def stats_upsert(db, deltas: StatsDeltas):
+    # Rows go in key order so that concurrent transactions lock the stats rows
+    # they share in the same order
+    rows = [
+        {
+            "magazine_id": magazine_id,
+            "plan_id": plan_id,
+            "active_count": count,
+            "active_revenue": revenue,
+        }
+        for (magazine_id, plan_id), (count, revenue) in sorted(deltas.items())
+        if count or revenue
+    ]
+    if not rows:
+        return None
+    stmt = dialect.insert(db, SubscriptionStats).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=["magazine_id", "plan_id"],
+        set_={
+            "active_count": SubscriptionStats.active_count + stmt.excluded.active_count,
+            "active_revenue": SubscriptionStats.active_revenue
+            + stmt.excluded.active_revenue,
+        },
+    )
+
+
+async def update_stats(db: AsyncSession, deltas: StatsDeltas):
+    # Runs in the caller's transaction; committing is up to the caller
+    stmt = stats_upsert(db, deltas)
+    if stmt is not None:
+        await db.execute(stmt)
+
+
+async def get_subscription_stats(db: AsyncSession) -> dict:
+    rows = await db.execute(
+        select(
+            SubscriptionStats.magazine_id,
+            SubscriptionStats.plan_id,
+            SubscriptionStats.active_count,
+            SubscriptionStats.active_revenue,
+            Plan.renewal_period,
+        )
+        .join(Plan, Plan.id == SubscriptionStats.plan_id)
+        .where(SubscriptionStats.active_count > 0)
+        .order_by(SubscriptionStats.magazine_id, SubscriptionStats.plan_id)
+    )
+    stats = [
+        {
+            "magazine_id": magazine_id,
+            "plan_id": plan_id,
+            "active_subscriptions": count,
+            "revenue": revenue,
+            # A price covers renewal_period months
+            "mrr": revenue / max(renewal_period, 1),
+        }
+        for magazine_id, plan_id, count, revenue, renewal_period in rows
+    ]
+    return {
+        "stats": stats,
+        "active_subscriptions": sum(row["active_subscriptions"] for row in stats),
+        "mrr": sum(row["mrr"] for row in stats),
+    }
+
+
+def reconcile_stats(engine) -> int:
+    """Rewrite the stats rows that disagree with subscriptions. Returns the
+    number of rows corrected."""
+    with Session(engine) as db:
+        if engine.dialect.name == "postgresql":
+            # Hold off stats writers (readers are fine) so that no delta lands
+            # between the recount and the correction
+            db.execute(text("LOCK TABLE subscription_stats IN EXCLUSIVE MODE"))
+        actual = {
+            (magazine_id, plan_id): (count, revenue)
+            for magazine_id, plan_id, count, revenue in db.execute(
+                select(
+                    Subscription.magazine_id,
+                    Subscription.plan_id,
+                    func.count(),
+                    func.sum(Subscription.price),
+                )
+                .where(Subscription.is_active == True)
+                .group_by(Subscription.magazine_id, Subscription.plan_id)
+            )
+        }
+        recorded = {
+            (magazine_id, plan_id): (count, revenue)
+            for magazine_id, plan_id, count, revenue in db.execute(
+                select(
+                    SubscriptionStats.magazine_id,
+                    SubscriptionStats.plan_id,
+                    SubscriptionStats.active_count,
+                    SubscriptionStats.active_revenue,
+                )
+            )
+        }
+        corrections = {}
+        for key in actual.keys() | recorded.keys():
+            count, revenue = actual.get(key, (0, 0.0))
+            recorded_count, recorded_revenue = recorded.get(key, (0, 0.0))
+            if (
+                count != recorded_count
+                or abs(revenue - recorded_revenue) > REVENUE_TOLERANCE
+            ):
+                corrections[key] = (
+                    count - recorded_count,
+                    revenue - recorded_revenue,
+                )
+        stmt = stats_upsert(db, corrections)
+        if stmt is not None:
+            db.execute(stmt)
+        db.commit()
+        return len(corrections)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Recompute subscription_stats from subscriptions."
+    )
+    parser.add_argument("--database-url", default=DATABASE_URL)
+    args = parser.parse_args()
+    engine = create_engine(args.database_url)
+    try:
+        corrected = reconcile_stats(engine)
+    finally:
+        engine.dispose()
+    print(f"Corrected {corrected} subscription_stats rows")
@@ -1,13 +1,33 @@
 # crud.py
-from sqlalchemy.orm import Session
-from app.models import User, Magazine, Plan, Subscription
-from pydantic import BaseModel, EmailStr
-from passlib.context import CryptContext
-from typing import List
+from sqlalchemy import event, exists, func, inspect, literal, or_, select, true, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, object_session
+from app.db import dialect
+from app.models import ACTIVE_SUBSCRIPTION, User, Magazine, Plan, Subscription
+from pydantic import (
+    BaseModel,
+    ConfigDict,
+    EmailStr,
+    Field,
+    ValidationError,
+    model_validator,
+)
+from typing import Iterable, List, Literal, Optional, Tuple
 from datetime import date
+import asyncio
+import logging
+from app.core.bloom import BloomFilter
+from app.core.cache import VersionedCache
+from app.core.config import settings
+from app.core.pagination import DEFAULT_PAGE_SIZE, keyset_page
+from app.core.security import password_hasher
+from app.pricing import MAGAZINE, PLAN, price_matrix
+from app.stats import stats_deltas, update_stats
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+logger = logging.getLogger(__name__)
+
+# Rendered GET /magazines/ payload, invalidated on any Magazine or Plan write
+catalog_cache = VersionedCache(ttl=settings.catalog_cache_ttl)
 
 
 # User models
@@ -31,23 +51,66 @@ class UserResponse(BaseModel):
 # Magazine models
 
 
+class MagazineCreate(BaseModel):
+    name: str
+    description: str
+    base_price: int = Field(gt=0)
+
+
+class PlanCreate(BaseModel):
+    title: str
+    description: str
+    renewal_period: int = Field(gt=0)
+    discount: float = Field(ge=0, le=1)
+    tier: int
+
+
 class MagazineResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
     id: int
     name: str
     description: str
     base_price: int
 
 
+class PlanResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    title: str
+    description: str
+    renewal_period: int
+    discount: float
+    tier: int
+
+
 class SubscriptionResponse(BaseModel):
     id: int
     user_id: int
     magazine_id: int
     plan_id: int
     price: float
-    renewal_date: str
+    renewal_date: date
     is_active: bool
 
 
+# Paginated listings
+class MagazinePage(BaseModel):
+    magazines: List[MagazineResponse]
+    next_cursor: Optional[str]
+
+
+class PlanPage(BaseModel):
+    plans: List[PlanResponse]
+    next_cursor: Optional[str]
+
+
+class SubscriptionPage(BaseModel):
+    subscriptions: List[SubscriptionResponse]
+    next_cursor: Optional[str]
+
+
 class SubscriptionCreate(BaseModel):
     user_id: int
     magazine_id: int
@@ -57,96 +120,598 @@ class SubscriptionCreate(BaseModel):
     is_active: bool
 
 
+class SubscriptionCancel(BaseModel):
+    subscription_ids: Optional[List[int]] = None
+    user_id: Optional[int] = None
+    magazine_id: Optional[int] = None
+
+    @model_validator(mode="after")
+    def check_target(self):
+        by_owner = self.user_id is not None and self.magazine_id is not None
+        if (self.subscription_ids is not None) == by_owner:
+            raise ValueError(
+                "Provide either subscription_ids or both user_id and magazine_id."
+            )
+        return self
+
+
+class CatalogImportError(BaseModel):
+    line: int
+    error: str
+
+
+class CatalogImportSummary(BaseModel):
+    inserted: int
+    updated: int
+    failed: int
+    errors: List[CatalogImportError]
+
+
+class SubscriptionBulkResult(BaseModel):
+    index: int
+    status: Literal["created", "conflict", "invalid"]
+    subscription: Optional[SubscriptionResponse] = None
+    detail: Optional[str] = None
+
+
+class SubscriptionBulkResponse(BaseModel):
+    created: int
+    conflicts: int
+    invalid: int
+    results: List[SubscriptionBulkResult]
+
+
+def _after(after_id: Optional[int]):
+    return None if after_id is None else (after_id,)
+
+
+class RegisteredUsers:
+    """Bloom filter over the usernames and emails of registered users.
+
+    A miss means the name is definitely free as of the last load plus this
+    worker's own registrations; a hit only means it may be taken. Users added
+    by other workers are seen once a background task rebuilds the filter,
+    every ``ttl`` seconds; until then the unique indexes remain the final
+    word. Requests never load the filter themselves."""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.filter: Optional[BloomFilter] = None
+        # Registrations made while a reload is reading the users table
+        self._pending: Optional[List[Tuple[str, str]]] = None
+
+    async def load(self, db: AsyncSession):
+        self._pending = []
+        try:
+            total = await db.scalar(select(func.count(User.id)))
+            bloom = BloomFilter(
+                max(settings.user_filter_capacity, 4 * total),
+                settings.user_filter_error_rate,
+            )
+            result = await db.stream(
+                select(User.username, User.email).execution_options(
+                    yield_per=settings.export_chunk_size
+                )
+            )
+            async for username, email in result:
+                bloom.add(f"username:{username}")
+                bloom.add(f"email:{email}")
+            for username, email in self._pending:
+                bloom.add(f"username:{username}")
+                bloom.add(f"email:{email}")
+        finally:
+            self._pending = None
+        self.filter = bloom
+
+    async def reload_periodically(self, session_factory):
+        # Requests keep answering from the current filter meanwhile
+        while True:
+            await asyncio.sleep(self.ttl)
+            try:
+                async for db in session_factory():
+                    await self.load(db)
+            except Exception:
+                logger.exception("Reloading the registered-users filter failed")
+
+    def add(self, username: str, email: str):
+        if self._pending is not None:
+            self._pending.append((username, email))
+        if self.filter is not None:
+            self.filter.add(f"username:{username}")
+            self.filter.add(f"email:{email}")
+
+    def may_be_taken(self, field: str, value: str) -> bool:
+        return self.filter is None or self.filter.might_contain(f"{field}:{value}")
+
+
+registered_users = RegisteredUsers(ttl=settings.user_filter_ttl)
+
+
+async def username_or_email_taken(
+    db: AsyncSession, username: Optional[str] = None, email: Optional[str] = None
+) -> bool:
+    # Only values the filter cannot rule out reach the database
+    conditions = []
+    if username is not None and registered_users.may_be_taken("username", username):
+        conditions.append(User.username == username)
+    if email is not None and registered_users.may_be_taken("email", email):
+        conditions.append(User.email == email)
+    if not conditions:
+        return False
+    return await db.scalar(select(exists().where(or_(*conditions))))
+
+
 # create user in the database with hashed password
 
 
-def create_user(db: Session, user: UserCreate):
-    hashed_password = pwd_context.hash(user.password)
-    db_user = User(name=user.name, email=user.email, hashed_password=hashed_password)
+async def create_user(db: AsyncSession, user: UserCreate):
+    hashed_password = await password_hasher.hash(user.password)
+    db_user = User(
+        username=user.username, email=user.email, hashed_password=hashed_password
+    )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    # The primary key comes back from the INSERT; nothing else to reload
+    await db.commit()
+    registered_users.add(user.username, user.email)
     return db_user
 
 
-def authenticate_user(db: Session, email: str, password: str):
-    user = db.query(User).filter(User.email == email).first()
-    if user and pwd_context.verify(password, user.hashed_password):
+async def authenticate_user(db: AsyncSession, email: str, password: str):
+    user = await db.scalar(select(User).where(User.email == email))
+    if user and await password_hasher.verify(password, user.hashed_password):
+        # Transparently move the stored hash to the configured cost
+        if password_hasher.needs_update(user.hashed_password):
+            user.hashed_password = await password_hasher.hash(password)
+            await db.commit()
         return user
     return None
 
 
-def get_magazines(db: Session):
-    return db.query(Magazine).all()
+async def get_magazines(
+    db: AsyncSession, limit: int = DEFAULT_PAGE_SIZE, after_id: Optional[int] = None
+):
+    return await keyset_page(
+        db, select(Magazine), (Magazine.id,), limit, _after(after_id)
+    )
 
 
 # Plan models
-def get_plans(db: Session):
-    return db.query(Plan).all()
-
-
-def create_subscription(db: Session, subscription: SubscriptionCreate):
-    # Check if the user already has an active subscription for the given magazine and plan
-    existing_subscription = (
-        db.query(Subscription)
-        .filter(
-            Subscription.user_id == subscription.user_id,
-            Subscription.magazine_id == subscription.magazine_id,
-            Subscription.plan_id == subscription.plan_id,
-            Subscription.is_active == True,
+async def get_plans(
+    db: AsyncSession, limit: int = DEFAULT_PAGE_SIZE, after_id: Optional[int] = None
+):
+    return await keyset_page(db, select(Plan), (Plan.id,), limit, _after(after_id))
+
+
+async def create_subscription(db: AsyncSession, subscription: SubscriptionCreate):
+    # Price the subscription in SQL from the current catalog and insert it in
+    # the same statement. Missing magazine or plan rows make the SELECT empty,
+    # and the partial unique index turns a second active subscription for the
+    # same magazine and plan into a no-op; both come back as no row.
+    source = (
+        select(
+            literal(subscription.user_id),
+            Magazine.id,
+            Plan.id,
+            Magazine.base_price * (1 - Plan.discount),
+            literal(subscription.renewal_date),
+            true(),
+        )
+        # The WHERE clause keeps SQLite from reading the join's ON as ON CONFLICT
+        .join_from(Magazine, Plan, true()).where(
+            Magazine.id == subscription.magazine_id,
+            Plan.id == subscription.plan_id,
+        )
+    )
+    stmt = (
+        dialect.insert(db, Subscription)
+        .from_select(
+            ["user_id", "magazine_id", "plan_id", "price", "renewal_date", "is_active"],
+            source,
+        )
+        .on_conflict_do_nothing(
+            index_elements=["user_id", "magazine_id", "plan_id"],
+            index_where=ACTIVE_SUBSCRIPTION,
         )
-        .first()
     )
 
-    if existing_subscription:
+    if dialect.supports_insert_returning(db):
+        db_subscription = await db.scalar(stmt.returning(Subscription))
+    else:
+        # SQLite before 3.35 has no RETURNING
+        result = await db.execute(stmt)
+        db_subscription = (
+            await db.get(Subscription, result.lastrowid) if result.rowcount else None
+        )
+
+    if db_subscription is None:
+        await db.rollback()
+        # Only the failure path pays for telling the two cases apart
+        catalog_found = await db.scalar(
+            select(
+                exists().where(Magazine.id == subscription.magazine_id)
+                & exists().where(Plan.id == subscription.plan_id)
+            )
+        )
+        if not catalog_found:
+            raise ValueError("Magazine or Plan not found.")
         raise ValueError(
             "User already has an active subscription for this magazine and plan."
         )
+    await update_stats(
+        db,
+        stats_deltas(
+            [
+                (
+                    db_subscription.magazine_id,
+                    db_subscription.plan_id,
+                    db_subscription.price,
+                )
+            ]
+        ),
+    )
+    await db.commit()
+    return db_subscription
+
 
-    # Retrieve magazine and plan
-    magazine = (
-        db.query(Magazine).filter(Magazine.id == subscription.magazine_id).first()
+# Bulk catalog import
+CATALOG_IMPORT_TARGETS = {
+    "magazines": (Magazine, MagazineCreate, "name"),
+    "plans": (Plan, PlanCreate, "title"),
+}
+MAX_REPORTED_IMPORT_ERRORS = 100
+
+
+async def import_catalog(
+    db: AsyncSession, kind: str, rows: Iterable[Tuple[int, object]]
+):
+    # rows yields (line number, parsed record or the exception raised while
+    # parsing it). Records are validated one at a time and upserted on the
+    # table's unique key in batches, so the upload is never held in memory.
+    model, schema, key = CATALOG_IMPORT_TARGETS[kind]
+    key_column = getattr(model, key)
+    summary = {"inserted": 0, "updated": 0, "failed": 0, "errors": []}
+
+    def fail(line, error):
+        summary["failed"] += 1
+        if len(summary["errors"]) < MAX_REPORTED_IMPORT_ERRORS:
+            summary["errors"].append({"line": line, "error": error})
+
+    async def flush(batch):
+        existing = set(
+            await db.scalars(select(key_column).where(key_column.in_(batch)))
+        )
+        stmt = dialect.insert(db, model)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[key],
+            set_={
+                name: stmt.excluded[name] for name in schema.model_fields if name != key
+            },
+        )
+        await db.execute(stmt, list(batch.values()))
+        await db.commit()
+        summary["updated"] += len(existing)
+        summary["inserted"] += len(batch) - len(existing)
+
+    batch = {}
+    try:
+        for line, record in rows:
+            if isinstance(record, Exception):
+                fail(line, str(record))
+                continue
+            try:
+                item = schema.model_validate(record)
+            except ValidationError as e:
+                fail(line, "; ".join(err["msg"] for err in e.errors()))
+                continue
+            # A key repeated within one statement cannot be upserted twice;
+            # the last occurrence wins
+            batch[getattr(item, key)] = item.model_dump()
+            if len(batch) >= settings.catalog_import_batch_size:
+                await flush(batch)
+                batch = {}
+        if batch:
+            await flush(batch)
+    finally:
+        # Bulk upserts bypass the ORM events that normally invalidate the catalog
+        invalidate_catalog()
+    return summary
+
+
+async def create_subscriptions_bulk(
+    db: AsyncSession, subscriptions: List[SubscriptionCreate]
+):
+    # One catalog lookup prices every requested magazine/plan pair
+    catalog = await db.execute(
+        select(Magazine.id, Plan.id, Magazine.base_price * (1 - Plan.discount))
+        .join_from(Magazine, Plan, true())
+        .where(
+            Magazine.id.in_({s.magazine_id for s in subscriptions}),
+            Plan.id.in_({s.plan_id for s in subscriptions}),
+        )
     )
-    plan = db.query(Plan).filter(Plan.id == subscription.plan_id).first()
-
-    if not magazine or not plan:
-        raise ValueError("Magazine or Plan not found.")
-
-    # Calculate the price at renewal
-    price = magazine.base_price * (1 - plan.discount)
-
-    # Create a new subscription
-    db_subscription = Subscription(
-        user_id=subscription.user_id,
-        magazine_id=subscription.magazine_id,
-        plan_id=subscription.plan_id,
-        price=price,
-        renewal_date=subscription.renewal_date,
-        is_active=True,
+    prices = {(magazine_id, plan_id): price for magazine_id, plan_id, price in catalog}
+    user_ids = set(
+        await db.scalars(
+            select(User.id).where(User.id.in_({s.user_id for s in subscriptions}))
+        )
     )
-    db.add(db_subscription)
-    db.commit()
-    db.refresh(db_subscription)
-    return db_subscription
 
+    results = [None] * len(subscriptions)
+    pending = {}
+    for index, subscription in enumerate(subscriptions):
+        key = (subscription.user_id, subscription.magazine_id, subscription.plan_id)
+        price = prices.get(key[1:])
+        if subscription.user_id not in user_ids:
+            results[index] = {"status": "invalid", "detail": "User not found."}
+        elif price is None:
+            results[index] = {
+                "status": "invalid",
+                "detail": "Magazine or Plan not found.",
+            }
+        elif key in pending:
+            results[index] = {"status": "conflict", "detail": "Duplicate item."}
+        else:
+            pending[key] = (
+                index,
+                {
+                    "user_id": subscription.user_id,
+                    "magazine_id": subscription.magazine_id,
+                    "plan_id": subscription.plan_id,
+                    "price": price,
+                    "renewal_date": subscription.renewal_date,
+                    "is_active": True,
+                },
+            )
+
+    if pending:
+        # Batched multi-row INSERT in a single transaction. Rows skipped by the
+        # partial unique index are missing from RETURNING, so results are
+        # matched back by key rather than by position.
+        stmt = dialect.insert(db, Subscription).on_conflict_do_nothing(
+            index_elements=["user_id", "magazine_id", "plan_id"],
+            index_where=ACTIVE_SUBSCRIPTION,
+        )
+        if dialect.supports_insert_returning(db):
+            created = await db.scalars(
+                stmt.returning(Subscription),
+                [params for _, params in pending.values()],
+            )
+        else:
+            # SQLite before 3.35 has no RETURNING: insert row by row, still in
+            # one transaction, and read the created rows back by id
+            ids = []
+            for _, params in pending.values():
+                result = await db.execute(stmt.values(params))
+                if result.rowcount:
+                    ids.append(result.lastrowid)
+            created = await db.scalars(
+                select(Subscription).where(Subscription.id.in_(ids))
+            )
+        for db_subscription in created.all():
+            index, _ = pending.pop(
+                (
+                    db_subscription.user_id,
+                    db_subscription.magazine_id,
+                    db_subscription.plan_id,
+                )
+            )
+            results[index] = {"status": "created", "subscription": db_subscription}
+        for index, _ in pending.values():
+            results[index] = {
+                "status": "conflict",
+                "detail": "User already has an active subscription for this magazine and plan.",
+            }
+        await update_stats(
+            db,
+            stats_deltas(
+                (
+                    row["subscription"].magazine_id,
+                    row["subscription"].plan_id,
+                    row["subscription"].price,
+                )
+                for row in results
+                if row["status"] == "created"
+            ),
+        )
+        await db.commit()
+
+    return results
+
+
+async def stream_subscriptions(
+    db: AsyncSession,
+    is_active: Optional[bool] = None,
+    magazine_id: Optional[int] = None,
+    renewal_from: Optional[date] = None,
+    renewal_to: Optional[date] = None,
+):
+    # Plain column tuples over a server-side cursor: nothing accumulates in
+    # the session's identity map, whatever the size of the table
+    stmt = select(
+        *(getattr(Subscription, name) for name in SubscriptionResponse.model_fields)
+    ).order_by(Subscription.id)
+    if is_active is not None:
+        stmt = stmt.where(Subscription.is_active == is_active)
+    if magazine_id is not None:
+        stmt = stmt.where(Subscription.magazine_id == magazine_id)
+    if renewal_from is not None:
+        stmt = stmt.where(Subscription.renewal_date >= renewal_from)
+    if renewal_to is not None:
+        stmt = stmt.where(Subscription.renewal_date <= renewal_to)
+
+    result = await db.stream(
+        stmt.execution_options(yield_per=settings.export_chunk_size)
+    )
+    async for rows in result.partitions():
+        yield rows
+
+
+async def get_active_subscriptions_for_user(
+    db: AsyncSession,
+    user_id: int,
+    limit: int = DEFAULT_PAGE_SIZE,
+    after_id: Optional[int] = None,
+):
+    return await keyset_page(
+        db,
+        select(Subscription).where(
+            Subscription.user_id == user_id, Subscription.is_active == True
+        ),
+        (Subscription.id,),
+        limit,
+        _after(after_id),
+    )
 
-def get_active_subscriptions_for_user(db: Session, user_id: int):
-    return (
-        db.query(Subscription)
-        .filter(Subscription.user_id == user_id, Subscription.is_active == True)
-        .all()
+
+async def get_upcoming_renewals(
+    db: AsyncSession,
+    renewal_from: date,
+    renewal_to: date,
+    limit: int = DEFAULT_PAGE_SIZE,
+    after: Optional[Tuple[date, int]] = None,
+):
+    # The predicate is spelled as in the partial index so SQLite can use it
+    return await keyset_page(
+        db,
+        select(Subscription).where(
+            ACTIVE_SUBSCRIPTION,
+            Subscription.renewal_date >= renewal_from,
+            Subscription.renewal_date <= renewal_to,
+        ),
+        (Subscription.renewal_date, Subscription.id),
+        limit,
+        after,
     )
 
 
-def cancel_subscription(db: Session, subscription_id: int):
-    subscription = (
-        db.query(Subscription).filter(Subscription.id == subscription_id).first()
+async def cancel_subscription(db: AsyncSession, subscription_id: int):
+    # Flip the flag and read the row back in one statement. Only a row that
+    # was still active counts against the stats.
+    stmt = (
+        update(Subscription)
+        .where(Subscription.id == subscription_id, Subscription.is_active == True)
+        .values(is_active=False)
+        .execution_options(synchronize_session=False)
+    )
+    if dialect.supports_update_returning(db):
+        subscription = await db.scalar(stmt.returning(Subscription))
+    else:
+        result = await db.execute(stmt)
+        subscription = (
+            await db.get(Subscription, subscription_id) if result.rowcount else None
+        )
+    if subscription is None:
+        # Unknown, or cancelled already
+        return await db.get(Subscription, subscription_id)
+    await update_stats(
+        db,
+        stats_deltas(
+            [(subscription.magazine_id, subscription.plan_id, subscription.price)],
+            sign=-1,
+        ),
     )
-    if subscription:
-        subscription.is_active = False
-        db.commit()
-        db.refresh(subscription)
+    await db.commit()
     return subscription
 
 
+async def cancel_subscriptions(
+    db: AsyncSession,
+    subscription_ids: Optional[List[int]] = None,
+    user_id: Optional[int] = None,
+    magazine_id: Optional[int] = None,
+):
+    # Set-based cancel of either explicit ids or all of a user's active
+    # subscriptions to a magazine. Returns the ids that were cancelled.
+    if subscription_ids is not None:
+        condition = Subscription.id.in_(subscription_ids)
+    else:
+        condition = (Subscription.user_id == user_id) & (
+            Subscription.magazine_id == magazine_id
+        )
+    stmt = (
+        update(Subscription)
+        .where(condition, Subscription.is_active == True)
+        .values(is_active=False)
+        .execution_options(synchronize_session=False)
+    )
+    columns = (
+        Subscription.id,
+        Subscription.magazine_id,
+        Subscription.plan_id,
+        Subscription.price,
+    )
+    if dialect.supports_update_returning(db):
+        cancelled = (await db.execute(stmt.returning(*columns))).all()
+    else:
+        cancelled = (
+            await db.execute(
+                select(*columns).where(condition, Subscription.is_active == True)
+            )
+        ).all()
+        await db.execute(stmt.where(Subscription.id.in_([row.id for row in cancelled])))
+    await update_stats(
+        db,
+        stats_deltas(
+            ((row.magazine_id, row.plan_id, row.price) for row in cancelled), sign=-1
+        ),
+    )
+    await db.commit()
+    return [row.id for row in cancelled]
+
+
+# Everything derived from the catalog that must be dropped when it changes
+def invalidate_catalog():
+    catalog_cache.invalidate()
+    price_matrix.invalidate()
+
+
+# Catalog cache invalidation. Writes are only flagged at flush time; the cache
+# is dropped once the transaction commits so that a concurrent reader cannot
+# re-cache rows that are about to change. Price changes are applied to the
+# price matrix at the same point.
+def _flag_catalog_write(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info["catalog_dirty"] = True
+
+
+PRICE_ATTRIBUTES = {Magazine: (MAGAZINE, "base_price"), Plan: (PLAN, "discount")}
+
+
+def _record_price_change(mapper, connection, target):
+    kind, attribute = PRICE_ATTRIBUTES[mapper.class_]
+    session = object_session(target)
+    if session is not None and inspect(target).attrs[attribute].history.has_changes():
+        session.info.setdefault("price_changes", {})[(kind, target.id)] = getattr(
+            target, attribute
+        )
+
+
+def _record_price_removal(mapper, connection, target):
+    kind, _ = PRICE_ATTRIBUTES[mapper.class_]
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault("price_changes", {})[(kind, target.id)] = None
+
+
+for _model in (Magazine, Plan):
+    for _event in ("after_insert", "after_update", "after_delete"):
+        event.listen(_model, _event, _flag_catalog_write)
+    event.listen(_model, "after_insert", _record_price_change)
+    event.listen(_model, "after_update", _record_price_change)
+    event.listen(_model, "after_delete", _record_price_removal)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_catalog_on_commit(session):
+    if session.info.pop("catalog_dirty", False):
+        catalog_cache.invalidate()
+    price_changes = session.info.pop("price_changes", None)
+    if price_changes:
+        price_matrix.apply(price_changes)
+
 
+@event.listens_for(Session, "after_rollback")
+def _discard_catalog_flag(session):
+    session.info.pop("catalog_dirty", None)
+    session.info.pop("price_changes", None)
@@ -0,0 +1,93 @@
+# Cold-start cost of importing the app, measured with `python -X importtime`
+# in fresh interpreters (best of --runs).
+#
+#   python -m benchmarks.importtime --budget-ms 1500
+#
+# Fails when the import takes longer than the budget, or when it loads any of
+# the modules that are meant to stay lazy until the app serves a request
+# (database drivers, passlib, python-jose).
+import argparse
+import os
+import subprocess
+import sys
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Sequence
+
+SRC = Path(__file__).resolve().parent.parent
+LAZY_MODULES = ("asyncpg", "psycopg2", "passlib", "jose", "aiosqlite", "numpy")
+DEFAULT_BUDGET_MS = 1500.0
+
+
+def import_profile(module: str) -> Dict[str, int]:
+    """Self time in microseconds per module imported by `import module`."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=SRC,
+        env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    profile = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:") :].split("|")
+        profile[name.strip()] = int(self_us)
+    return profile
+
+
+def measure(module: str = "app.main", runs: int = 5) -> dict:
+    profiles = [import_profile(module) for _ in range(runs)]
+    best = min(profiles, key=lambda profile: sum(profile.values()))
+    packages: Dict[str, int] = defaultdict(int)
+    for name, self_us in best.items():
+        packages[name.split(".")[0]] += self_us
+    return {
+        "module": module,
+        "total_ms": sum(best.values()) / 1000,
+        "packages_ms": {
+            name: us / 1000
+            for name, us in sorted(packages.items(), key=lambda item: -item[1])
+        },
+        "modules": sorted(best),
+    }
+
+
+def check(
+    result: dict, budget_ms: float, lazy: Sequence[str] = LAZY_MODULES
+) -> List[str]:
+    problems = []
+    if result["total_ms"] > budget_ms:
+        problems.append(
+            f"import {result['module']} took {result['total_ms']:.1f}ms, "
+            f"budget is {budget_ms:.1f}ms"
+        )
+    loaded = {name.split(".")[0] for name in result["modules"]}
+    for name in lazy:
+        if name in loaded:
+            problems.append(f"import {result['module']} loaded {name}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    result = measure(args.module, args.runs)
+    print(f"import {args.module}: {result['total_ms']:.1f}ms (best of {args.runs})")
+    for name, ms in list(result["packages_ms"].items())[: args.top]:
+        print(f"  {name:<25} {ms:8.1f}ms")
+    problems = check(result, args.budget_ms)
+    if problems:
+        print("Import budget exceeded:", *problems, sep="\n  ")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+# In-process HTTP load test of app.main:app. Virtual users repeatedly walk
+# register -> login -> catalog -> subscribe -> list -> cancel through httpx's
+# ASGI transport; latency is recorded per route template.
+#
+#   python -m benchmarks.load --concurrency 16 --duration 30
+#   python -m benchmarks.load --database-url postgresql+asyncpg://... \
+#       --output load.json --baseline benchmarks/load_baseline.json
+#
+# Results are written as JSON. With a baseline, the run fails when a route's
+# p50 grows or its throughput drops by more than --tolerance, or its p95/p99
+# grow by more than --tail-tolerance. --write-baseline stores the current run
+# as the new baseline.
+import argparse
+import asyncio
+import json
+import sys
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from app.core.security import password_hasher
+from app.db.session import Base, get_db, get_read_db
+from app.main import app
+from app.models import Magazine, Plan
+
+DEFAULT_DATABASE_URL = "sqlite+aiosqlite:///./load_benchmark.db"
+DEFAULT_BASELINE = Path(__file__).with_name("load_baseline.json")
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    async def call(self, client, method, route, url, expected=200, **kwargs):
+        start = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        key = f"{method} {route}"
+        self.latencies[key].append(time.perf_counter() - start)
+        if response.status_code != expected:
+            self.errors[key] += 1
+            return None
+        return response.json()
+
+    def summary(self, elapsed: float) -> Dict[str, dict]:
+        routes = {}
+        for key, samples in sorted(self.latencies.items()):
+            routes[key] = {
+                "requests": len(samples),
+                "errors": self.errors.get(key, 0),
+                "throughput": len(samples) / elapsed,
+                **{
+                    f"p{pct}_ms": percentile(samples, pct) * 1000 for pct in PERCENTILES
+                },
+            }
+        return routes
+
+
+async def user_flow(client, recorder: Recorder, catalog, deadline: float):
+    magazine_ids, plan_ids = catalog
+    step = 0
+    while time.perf_counter() < deadline:
+        name = uuid.uuid4().hex[:12]
+        password = f"pw-{name}"
+        user = await recorder.call(
+            client,
+            "POST",
+            "/users/register",
+            "/users/register",
+            expected=201,
+            json={
+                "username": name,
+                "email": f"{name}@load.example.com",
+                "password": password,
+            },
+        )
+        if user is None:
+            continue
+        await recorder.call(
+            client,
+            "POST",
+            "/users/login",
+            "/users/login",
+            json={"email": f"{name}@load.example.com", "password": password},
+        )
+        await recorder.call(client, "GET", "/magazines/", "/magazines/")
+        await recorder.call(client, "GET", "/plans/", "/plans/")
+        step += 1
+        subscription = await recorder.call(
+            client,
+            "POST",
+            "/subscriptions/",
+            "/subscriptions/",
+            json={
+                "user_id": user["user_id"],
+                "magazine_id": magazine_ids[step % len(magazine_ids)],
+                "plan_id": plan_ids[step % len(plan_ids)],
+                "price": 0,
+                "renewal_date": "2030-01-01",
+                "is_active": True,
+            },
+        )
+        await recorder.call(
+            client,
+            "GET",
+            "/subscriptions/{user_id}/",
+            f"/subscriptions/{user['user_id']}/",
+        )
+        if subscription is not None:
+            await recorder.call(
+                client,
+                "POST",
+                "/subscriptions/{subscription_id}/cancel/",
+                f"/subscriptions/{subscription['id']}/cancel/",
+            )
+
+
+async def seed_catalog(session_factory, size: int = 20):
+    async with session_factory() as db:
+        suffix = uuid.uuid4().hex[:8]
+        magazines = [
+            Magazine(name=f"Load {suffix} {i}", description="Load", base_price=10 + i)
+            for i in range(size)
+        ]
+        plans = [
+            Plan(
+                title=f"Load {suffix} {i}",
+                description="Load",
+                renewal_period=1 + i % 12,
+                discount=(i % 5) / 10,
+                tier=i,
+            )
+            for i in range(4)
+        ]
+        db.add_all(magazines + plans)
+        await db.commit()
+        return [m.id for m in magazines], [p.id for p in plans]
+
+
+async def run_benchmark(
+    database_url: str = DEFAULT_DATABASE_URL,
+    concurrency: int = 8,
+    duration: float = 10.0,
+    bcrypt_rounds: Optional[int] = 4,
+) -> dict:
+    engine = create_async_engine(database_url)
+    session_factory = async_sessionmaker(
+        bind=engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+    )
+
+    async def override_get_db():
+        async with session_factory() as db:
+            yield db
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    catalog = await seed_catalog(session_factory)
+
+    saved_overrides = dict(app.dependency_overrides)
+    saved_rounds = password_hasher.rounds
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_db
+    if bcrypt_rounds is not None:
+        password_hasher.set_rounds(bcrypt_rounds)
+    recorder = Recorder()
+    try:
+        # Start the hashing workers before the clock does
+        await password_hasher.hash("warm-up")
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://benchmark"
+        ) as client:
+            start = time.perf_counter()
+            deadline = start + duration
+            await asyncio.gather(
+                *(
+                    user_flow(client, recorder, catalog, deadline)
+                    for _ in range(concurrency)
+                )
+            )
+            elapsed = time.perf_counter() - start
+    finally:
+        app.dependency_overrides.clear()
+        app.dependency_overrides.update(saved_overrides)
+        if bcrypt_rounds is not None:
+            password_hasher.set_rounds(saved_rounds)
+        else:
+            password_hasher.shutdown()
+        await engine.dispose()
+
+    return {
+        "config": {
+            "database": engine.url.get_backend_name(),
+            "concurrency": concurrency,
+            "duration": duration,
+            "bcrypt_rounds": bcrypt_rounds,
+        },
+        "elapsed": elapsed,
+        "routes": recorder.summary(elapsed),
+    }
+
+
+def compare(
+    results: dict, baseline: dict, tolerance: float, tail_tolerance: float
+) -> List[str]:
+    regressions = []
+    for route, expected in baseline["routes"].items():
+        actual = results["routes"].get(route)
+        if actual is None:
+            regressions.append(f"{route}: no requests recorded")
+            continue
+        for pct in PERCENTILES:
+            field = f"p{pct}_ms"
+            allowed = tolerance if pct == 50 else tail_tolerance
+            if actual[field] > expected[field] * (1 + allowed):
+                regressions.append(
+                    f"{route}: {field} {actual[field]:.2f} > "
+                    f"baseline {expected[field]:.2f} (+{allowed:.0%})"
+                )
+        if actual["throughput"] < expected["throughput"] * (1 - tolerance):
+            regressions.append(
+                f"{route}: throughput {actual['throughput']:.1f}/s < "
+                f"baseline {expected['throughput']:.1f}/s (-{tolerance:.0%})"
+            )
+        if actual["errors"]:
+            regressions.append(f"{route}: {actual['errors']} unexpected responses")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database-url", default=DEFAULT_DATABASE_URL)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument(
+        "--bcrypt-rounds",
+        type=int,
+        default=4,
+        help="bcrypt cost for the run; keeps register/login from dominating",
+    )
+    parser.add_argument("--output", type=Path, default=Path("load_benchmark.json"))
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="allowed relative p50 increase and throughput drop",
+    )
+    parser.add_argument(
+        "--tail-tolerance",
+        type=float,
+        default=1.0,
+        help="allowed relative p95/p99 increase; tails are noisier",
+    )
+    parser.add_argument("--write-baseline", action="store_true")
+    args = parser.parse_args()
+
+    results = asyncio.run(
+        run_benchmark(
+            args.database_url, args.concurrency, args.duration, args.bcrypt_rounds
+        )
+    )
+    args.output.write_text(json.dumps(results, indent=2))
+    for route, stats in results["routes"].items():
+        print(
+            f"{route:<45} {stats['throughput']:8.1f}/s  "
+            + "  ".join(f"p{pct} {stats[f'p{pct}_ms']:7.2f}ms" for pct in PERCENTILES)
+        )
+
+    if args.write_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2))
+        print(f"Baseline written to {args.baseline}")
+        return
+    if args.baseline.exists():
+        regressions = compare(
+            results,
+            json.loads(args.baseline.read_text()),
+            args.tolerance,
+            args.tail_tolerance,
+        )
+        if regressions:
+            print("Regressions against baseline:", *regressions, sep="\n  ")
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# Per-row cost of rendering subscriptions: the old response_model path
+# (validate + jsonable_encoder + json.dumps) against direct row encoding.
+#
+#   python -m benchmarks.serialization --rows 1000 --repeat 20
+import argparse
+import json
+import timeit
+from datetime import date
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from app.core.responses import encode_rows
+from app.models import Subscription
+from app.views import SubscriptionResponse
+
+
+def make_rows(count: int):
+    return [
+        Subscription(
+            id=i,
+            user_id=i % 97,
+            magazine_id=i % 13,
+            plan_id=i % 4,
+            price=9.99,
+            renewal_date=date(2025, 1, 1 + i % 28),
+            is_active=True,
+        )
+        for i in range(count)
+    ]
+
+
+def response_model_path(rows, adapter):
+    validated = adapter.validate_python(rows, from_attributes=True)
+    return json.dumps(jsonable_encoder(validated)).encode()
+
+
+def direct_path(rows):
+    return encode_rows(rows, SubscriptionResponse)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    adapter = TypeAdapter(List[SubscriptionResponse])
+    assert json.loads(response_model_path(rows, adapter)) == json.loads(
+        direct_path(rows)
+    )
+
+    results = {
+        "response_model": min(
+            timeit.repeat(
+                lambda: response_model_path(rows, adapter), number=1, repeat=args.repeat
+            )
+        ),
+        "direct": min(
+            timeit.repeat(lambda: direct_path(rows), number=1, repeat=args.repeat)
+        ),
+    }
+    for name, seconds in results.items():
+        print(f"{name:>15}: {seconds / args.rows * 1e6:8.2f} us/row")
+    print(f"{'speedup':>15}: {results['response_model'] / results['direct']:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
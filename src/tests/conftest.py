@@ -2,16 +2,24 @@ import pytest
 import random
 import os
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from starlette.routing import Match
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+# Settings are read on import; tests run in one process
+os.environ.setdefault("JWT_DEV_SECRET", "true")
+
 from app.main import app
+from app.models import Magazine, Plan
 
 # from app.db.base import Base
-from app.db.session import get_db, Base
+from app.db.session import get_db, get_read_db, Base
 from .utils import create_user, login_user
 
 # Define a SQLite URL for testing
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+ASYNC_SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
 
 # Create the engine and session for the test database
 engine = create_engine(
@@ -19,18 +27,26 @@ engine = create_engine(
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# aiosqlite stand-in for the async engine used by the API. NullPool keeps
+# connections from being shared between the event loops of different clients.
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, poolclass=NullPool)
+AsyncTestingSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False,
+)
+
 
 # Dependency override for the test database
-def override_get_db():
-    try:
-        db = TestingSessionLocal()
+async def override_get_db():
+    async with AsyncTestingSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
 # Apply the override to the FastAPI app
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_read_db] = override_get_db
 
 # Create the database tables
 Base.metadata.create_all(bind=engine)
@@ -112,6 +128,98 @@ def create_magazine(client, admin_user):
     return response.json()
 
 
+@pytest.fixture(scope="function")
+def db():
+    with TestingSessionLocal() as session:
+        yield session
+
+
+@pytest.fixture(scope="function")
+def magazine():
+    with TestingSessionLocal() as db:
+        db_magazine = Magazine(
+            name=f"Magazine {random.randint(100000, 999999)}",
+            description="Seeded magazine",
+            base_price=100,
+        )
+        db.add(db_magazine)
+        db.commit()
+        db.refresh(db_magazine)
+        return db_magazine
+
+
+@pytest.fixture(scope="function")
+def plan():
+    with TestingSessionLocal() as db:
+        db_plan = Plan(
+            title=f"Plan {random.randint(100000, 999999)}",
+            description="Seeded plan",
+            renewal_period=3,
+            discount=0.1,
+            tier=1,
+        )
+        db.add(db_plan)
+        db.commit()
+        db.refresh(db_plan)
+        return db_plan
+
+
+def route_template(method: str, url: str) -> str:
+    path = url.split("?", 1)[0]
+    scope = {"type": "http", "method": method, "path": path}
+    for route in app.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return path
+
+
+# SQL budgets per endpoint, e.g.
+#
+#   @pytest.mark.query_budget({"POST /subscriptions/": 2})
+#   def test_...(client, query_budget):
+#       query_budget["GET /subscriptions/{user_id}/"] = 1
+#
+# Every client call made while the fixture is active counts the statements
+# it sends to the test database and fails the test, listing them, when the
+# budget of its route is exceeded.
+@pytest.fixture(scope="function")
+def query_budget(request, client, monkeypatch):
+    budgets = {}
+    marker = request.node.get_closest_marker("query_budget")
+    if marker is not None:
+        budgets.update(*marker.args, **marker.kwargs)
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    send = client.request
+
+    def request_with_budget(method, url, *args, **kwargs):
+        del statements[:]
+        response = send(method, url, *args, **kwargs)
+        key = f"{method.upper()} {route_template(method.upper(), str(url))}"
+        budget = budgets.get(key)
+        if budget is not None and len(statements) > budget:
+            captured = "\n".join(
+                f"  {number}. {statement} {parameters!r}"
+                for number, (statement, parameters) in enumerate(statements, 1)
+            )
+            pytest.fail(
+                f"{key} ran {len(statements)} SQL statements, budget is {budget}:\n"
+                f"{captured}",
+                pytrace=False,
+            )
+        return response
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", record)
+    monkeypatch.setattr(client, "request", request_with_budget)
+    yield budgets
+    event.remove(async_engine.sync_engine, "before_cursor_execute", record)
+
+
 @pytest.fixture(scope="session", autouse=True)
 def cleanup():
     yield
@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+import pytest
+from sqlalchemy import exc
+
+from app import main
+from app.core.admission import AUTH, CATALOG, SUBSCRIPTION_WRITES, AdaptiveLimiter, Overloaded, admission, route_class
+
+
+def test_route_classes():
+    assert route_class("POST", "/users/login") == AUTH
+    assert route_class("POST", "/users/register") == AUTH
+    assert route_class("GET", "/magazines/") == CATALOG
+    assert route_class("GET", "/plans/") == CATALOG
+    assert route_class("GET", "/pricing/matrix") == CATALOG
+    assert route_class("POST", "/subscriptions/") == SUBSCRIPTION_WRITES
+    assert route_class("POST", "/subscriptions/5/cancel/") == SUBSCRIPTION_WRITES
+    assert route_class("GET", "/subscriptions/5/") is None
+    assert route_class("GET", "/metrics") is None
+
+
+@pytest.mark.asyncio
+async def test_limiter_queues_then_sheds():
+    limiter = AdaptiveLimiter(initial_limit=1, max_limit=1, queue_timeout=0.1)
+    await limiter.acquire()
+
+    # A waiter gets the slot when the running request finishes
+    waiter = asyncio.ensure_future(limiter.acquire())
+    await asyncio.sleep(0)
+    assert limiter.queued == 1
+    limiter.release(0.01)
+    await waiter
+    assert limiter.in_flight == 1 and limiter.queued == 0
+
+    # Nobody finishes in time: the waiter is shed at the deadline
+    with pytest.raises(Overloaded):
+        await limiter.acquire()
+    assert limiter.rejected == 1
+    assert limiter.queued == 0
+
+    # Expected wait beyond the deadline: shed without waiting
+    limiter.baseline = 5.0
+    start = time.perf_counter()
+    with pytest.raises(Overloaded) as error:
+        await limiter.acquire()
+    assert time.perf_counter() - start < 0.05
+    assert error.value.retry_after >= 5.0
+
+
+def test_limiter_adapts_to_latency():
+    limiter = AdaptiveLimiter(initial_limit=10, min_limit=2, max_limit=12)
+    for _ in range(20):
+        limiter.in_flight += 1
+        limiter.release(0.01)
+    assert limiter.limit > 10
+    grown = limiter.limit
+
+    limiter.in_flight += 1
+    limiter.release(1.0)
+    assert limiter.limit == pytest.approx(grown * limiter.backoff)
+
+    limiter.in_flight += 1
+    limiter.release(0.01, overloaded=True)
+    assert limiter.limit < grown * limiter.backoff
+
+    for _ in range(100):
+        limiter.in_flight += 1
+        limiter.release(10.0, overloaded=True)
+    assert limiter.limit == 2
+
+
+def test_overloaded_route_class_returns_503(client, monkeypatch):
+    limiter = admission.limiters[AUTH]
+    monkeypatch.setattr(limiter, "in_flight", int(limiter.limit))
+    monkeypatch.setattr(limiter, "baseline", 30.0)
+    response = client.post("/users/login", json={"email": "shed@example.com", "password": "x"})
+    assert response.status_code == 503, f"Response status code: {response.status_code}, Response body: {response.text}"
+    assert int(response.headers["Retry-After"]) >= 1
+    # Other route classes are unaffected
+    response = client.get("/magazines/")
+    assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+    assert 'admission_rejected_total{class="auth"}' in client.get("/metrics").text
+
+
+def test_pool_timeout_returns_503(client, monkeypatch):
+    async def pool_exhausted(*args):
+        raise exc.TimeoutError("QueuePool limit reached")
+
+    monkeypatch.setattr(main, "get_active_subscriptions_for_user", pool_exhausted)
+    response = client.get("/subscriptions/1/")
+    assert response.status_code == 503, f"Response status code: {response.status_code}, Response body: {response.text}"
+    assert response.headers["Retry-After"] == "1"
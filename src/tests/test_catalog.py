@@ -0,0 +1,58 @@
+import json
+import random
+
+from app.core.config import settings
+from app.models import Magazine, Plan
+
+
+def test_import_magazines_csv(client, db, magazine, monkeypatch):
+    monkeypatch.setattr(settings, "catalog_import_batch_size", 2)
+    suffix = random.randint(100000, 999999)
+    etag = client.get("/magazines/").headers["ETag"]
+    upload = "\n".join([
+        "name,description,base_price",
+        f"Imported A {suffix},First import,12",
+        f"Imported B {suffix},Second import,0",
+        f"{magazine.name},Updated by import,55",
+        f"Imported C {suffix},Third import,not-a-number",
+        f"Imported D {suffix},Fourth import,30",
+    ])
+
+    response = client.post(
+        "/catalog/import",
+        params={"kind": "magazines", "format": "csv"},
+        files={"file": ("magazines.csv", upload.encode(), "text/csv")},
+    )
+    assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+    summary = response.json()
+    assert (summary["inserted"], summary["updated"], summary["failed"]) == (2, 1, 2)
+    assert [e["line"] for e in summary["errors"]] == [3, 5]
+
+    db.expire_all()
+    assert db.get(Magazine, magazine.id).base_price == 55
+    assert db.query(Magazine).filter(Magazine.name == f"Imported D {suffix}").one().base_price == 30
+
+    # The catalog cache must not keep serving the pre-import listing
+    response = client.get("/magazines/", headers={"If-None-Match": etag})
+    assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+
+
+def test_import_plans_ndjson(client, db):
+    suffix = random.randint(100000, 999999)
+    records = [
+        {"title": f"Imported plan {suffix}", "description": "Monthly", "renewal_period": 1, "discount": 0.0, "tier": 1},
+        {"title": f"Imported plan {suffix}", "description": "Monthly, revised", "renewal_period": 1, "discount": 0.05, "tier": 1},
+        {"title": f"Broken plan {suffix}", "description": "Never renews", "renewal_period": 0, "discount": 0.0, "tier": 1},
+    ]
+    upload = "\n".join(json.dumps(r) for r in records) + "\n{not json\n"
+
+    response = client.post(
+        "/catalog/import",
+        params={"kind": "plans", "format": "ndjson"},
+        files={"file": ("plans.ndjson", upload.encode(), "application/x-ndjson")},
+    )
+    assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+    summary = response.json()
+    assert (summary["inserted"], summary["updated"], summary["failed"]) == (1, 0, 2)
+    plan = db.query(Plan).filter(Plan.title == f"Imported plan {suffix}").one()
+    assert plan.description == "Monthly, revised"
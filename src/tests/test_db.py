@@ -0,0 +1,129 @@
+import random
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, exc, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from app.core.config import settings
+from app.db import session
+from app.db.pool import InstrumentedQueuePool, pool_status
+from app.db.session import Base, get_read_db, to_async_url
+from app.main import app
+from .conftest import AsyncTestingSessionLocal
+
+
+def test_async_url_derived_from_sync_url():
+    assert to_async_url("postgresql+psycopg2://u:p@db/app") == "postgresql+asyncpg://u:p@db/app"
+    assert to_async_url("sqlite:///./app.db") == "sqlite+aiosqlite:///./app.db"
+
+
+def test_pool_counts_waits_and_timeouts(tmp_path):
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'pool.db'}",
+        poolclass=InstrumentedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.05,
+    )
+    first = engine.connect()
+    first.execute(text("SELECT 1"))
+    status = pool_status(engine.pool)
+    assert status["checked_out"] == 1
+    assert status["waits"] == 0
+
+    with pytest.raises(exc.TimeoutError):
+        engine.connect()
+    first.close()
+    with engine.connect() as second:
+        second.execute(text("SELECT 1"))
+
+    status = pool_status(engine.pool)
+    assert status["checked_out"] == 0
+    assert status["checkouts"] == 2
+    assert status["waits"] == 1
+    assert status["timeouts"] == 1
+    assert status["max_checkout_ms"] >= status["avg_checkout_ms"] > 0
+    engine.dispose()
+
+
+def test_pool_stats_endpoint(client):
+    response = client.get("/db/pool")
+    assert response.status_code == 200, f"Response status code: {response.status_code}"
+    primary = response.json()["primary"]
+    assert primary["pool_class"] == "InstrumentedAsyncQueuePool"
+    assert {"size", "max_overflow", "checked_out", "overflow", "waits", "avg_checkout_ms"} <= primary.keys()
+
+
+def test_reads_use_replica_except_after_own_writes(tmp_path, monkeypatch, magazine, plan):
+    # The replica is a second SQLite file that never receives the writes
+    replica_engine = create_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+    Base.metadata.create_all(replica_engine)
+    replica_engine.dispose()
+    replica_async_engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'replica.db'}", poolclass=NullPool)
+    replica_sessionmaker = async_sessionmaker(bind=replica_async_engine, expire_on_commit=False)
+    monkeypatch.setattr(session, "primary_sessionmaker", lambda: AsyncTestingSessionLocal)
+    monkeypatch.setattr(session, "read_sessionmaker", lambda: replica_sessionmaker)
+    monkeypatch.delitem(app.dependency_overrides, get_read_db)
+    monkeypatch.setattr(settings, "read_your_writes_window", 60.0)
+
+    user_id = random.randint(10**6, 10**7)
+    with TestClient(app) as client:
+        response = client.post("/subscriptions/", json={
+            "user_id": user_id,
+            "magazine_id": magazine.id,
+            "plan_id": plan.id,
+            "price": 0,
+            "renewal_date": "2024-12-31",
+            "is_active": True,
+        })
+        assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+        assert "primary_until" in client.cookies
+
+        response = client.get(f"/subscriptions/{user_id}/")
+        assert [s["user_id"] for s in response.json()["subscriptions"]] == [user_id]
+
+        client.cookies.clear()
+        response = client.get(f"/subscriptions/{user_id}/")
+        assert response.json()["subscriptions"] == []
+
+        # A stamp we could not have set does not pin reads to the primary
+        client.cookies.set("primary_until", "99999999999")
+        response = client.get(f"/subscriptions/{user_id}/")
+        assert response.json()["subscriptions"] == []
+
+
+def test_writer_not_served_catalog_cached_from_replica(tmp_path, monkeypatch):
+    replica_engine = create_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+    Base.metadata.create_all(replica_engine)
+    replica_engine.dispose()
+    replica_async_engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'replica.db'}", poolclass=NullPool)
+    replica_sessionmaker = async_sessionmaker(bind=replica_async_engine, expire_on_commit=False)
+    monkeypatch.setattr(session, "primary_sessionmaker", lambda: AsyncTestingSessionLocal)
+    monkeypatch.setattr(session, "read_sessionmaker", lambda: replica_sessionmaker)
+    monkeypatch.delitem(app.dependency_overrides, get_read_db)
+    monkeypatch.setattr(settings, "read_your_writes_window", 60.0)
+
+    name = f"Lagging {random.randint(10**6, 10**7)}"
+    with TestClient(app) as client:
+        response = client.post(
+            "/catalog/import",
+            params={"kind": "magazines", "format": "csv"},
+            files={"file": ("magazines.csv", f"name,description,base_price\n{name},Imported,12\n".encode(), "text/csv")},
+        )
+        assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+        primary_until = client.cookies["primary_until"]
+
+        # Another client refills the cache from the replica, which has not
+        # caught up yet
+        client.cookies.clear()
+        for path in ("/magazines/", "/pricing/matrix"):
+            assert client.get(path, params={"limit": 1000} if path == "/magazines/" else None).status_code == 200
+
+        client.cookies.set("primary_until", primary_until)
+        response = client.get("/magazines/", params={"limit": 1000})
+        magazine_ids = [m["id"] for m in response.json()["magazines"] if m["name"] == name]
+        assert len(magazine_ids) == 1
+        response = client.get("/pricing/matrix")
+        assert magazine_ids[0] in response.json()["magazine_ids"]
@@ -0,0 +1,30 @@
+import pytest
+
+from app.db.session import get_db
+from app.main import app
+from benchmarks.load import compare, percentile, run_benchmark
+
+
+def test_percentile():
+    samples = [float(i) for i in range(1, 101)]
+    assert percentile(samples, 50) == 50.0
+    assert percentile(samples, 99) == 99.0
+    assert percentile([], 95) == 0.0
+
+
+@pytest.mark.asyncio
+async def test_load_benchmark_smoke(tmp_path):
+    overrides = dict(app.dependency_overrides)
+    results = await run_benchmark(f"sqlite+aiosqlite:///{tmp_path / 'load.db'}", concurrency=2, duration=1.0)
+    assert app.dependency_overrides == overrides
+    assert app.dependency_overrides[get_db] is overrides[get_db]
+
+    routes = results["routes"]
+    assert {"POST /users/register", "POST /users/login", "GET /magazines/", "POST /subscriptions/", "GET /subscriptions/{user_id}/", "POST /subscriptions/{subscription_id}/cancel/"} <= routes.keys()
+    for stats in routes.values():
+        assert stats["errors"] == 0
+        assert stats["p50_ms"] <= stats["p95_ms"] <= stats["p99_ms"]
+    assert compare(results, results, tolerance=0.0, tail_tolerance=0.0) == []
+
+    faster_baseline = {"routes": {route: dict(stats, p50_ms=stats["p50_ms"] / 2) for route, stats in routes.items()}}
+    assert len(compare(results, faster_baseline, tolerance=0.25, tail_tolerance=1.0)) == len(routes)
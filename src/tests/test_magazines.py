@@ -1,4 +1,10 @@
+import asyncio
+import random
+import httpx
 import pytest
+from app import main
+from app.main import app
+from app.models import Magazine
 from .utils import create_user, login_user, create_plan, create_magazine
 
 def test_create_magazine(client, unique_username, unique_email):
@@ -57,3 +63,93 @@ def test_delete_magazine(client, unique_username, unique_email):
     # Verify magazine is deleted
     response = client.get(f"/magazines/{magazine['id']}", headers=headers)
     assert response.status_code == 404, f"Response status code: {response.status_code}, Response body: {response.text}"
+
+
+def test_list_magazines_includes_catalog(client, magazine, plan):
+    response = client.get("/magazines/")
+    assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+    assert magazine.name in [m["name"] for m in response.json()["magazines"]]
+    response = client.get("/plans/")
+    assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+    assert plan.title in [p["title"] for p in response.json()["plans"]]
+
+
+@pytest.mark.asyncio
+async def test_list_magazines_concurrently(magazine):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+        responses = await asyncio.gather(*(ac.get("/magazines/") for _ in range(20)))
+    assert all(r.status_code == 200 for r in responses)
+
+
+def test_list_magazines_not_modified(client, magazine, monkeypatch):
+    # Clients still pinned to the primary after a write bypass the cache
+    client.cookies.clear()
+    response = client.get("/magazines/")
+    assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+    etag = response.headers["ETag"]
+
+    # Served from the cache: the catalog queries must not run again
+    async def fail(*args):
+        raise AssertionError("catalog was queried")
+
+    monkeypatch.setattr(main, "get_magazines", fail)
+    monkeypatch.setattr(main, "get_plans", fail)
+    response = client.get("/magazines/", headers={"If-None-Match": etag})
+    assert response.status_code == 304, f"Response status code: {response.status_code}, Response body: {response.text}"
+    assert response.content == b""
+    response = client.get("/magazines/")
+    assert response.status_code == 200
+    assert response.headers["ETag"] == etag
+
+
+def test_list_magazines_query_budget(client, query_budget, magazine):
+    # One query for the page, then none while the cached page is valid
+    client.cookies.clear()
+    query_budget["GET /magazines/"] = 1
+    response = client.get("/magazines/")
+    assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+    query_budget["GET /magazines/"] = 0
+    response = client.get("/magazines/")
+    assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+
+
+def test_list_magazines_invalidated_on_catalog_write(client, db, magazine):
+    etag = client.get("/magazines/").headers["ETag"]
+
+    db_magazine = db.get(Magazine, magazine.id)
+    db_magazine.base_price = 250
+    db.commit()
+
+    response = client.get("/magazines/", headers={"If-None-Match": etag})
+    assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+    assert response.headers["ETag"] != etag
+    prices = {m["id"]: m["base_price"] for m in response.json()["magazines"]}
+    assert prices[magazine.id] == 250
+
+
+def test_list_magazines_keyset_pagination(client, db):
+    for i in range(3):
+        db.add(Magazine(name=f"Paged {i} {random.randint(100000, 999999)}", description="Paged", base_price=10))
+    db.commit()
+    expected = [m.id for m in db.query(Magazine).order_by(Magazine.id)]
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2} if cursor is None else {"limit": 2, "cursor": cursor}
+        response = client.get("/magazines/", params=params)
+        assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+        page = response.json()
+        assert len(page["magazines"]) <= 2
+        seen += [m["id"] for m in page["magazines"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == expected
+
+
+def test_list_magazines_rejects_bad_cursor(client):
+    response = client.get("/magazines/", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400, f"Response status code: {response.status_code}, Response body: {response.text}"
+    response = client.get("/magazines/", params={"limit": 0})
+    assert response.status_code == 422, f"Response status code: {response.status_code}, Response body: {response.text}"
@@ -0,0 +1,48 @@
+import random
+import re
+
+from app.core.metrics import Histogram, metrics
+
+
+def _sample(text, name, **labels):
+    pattern = re.escape(name) + r"\{" + ",".join(f'{key}="{re.escape(str(value))}"' for key, value in labels.items()) + r"\} (\S+)"
+    match = re.search(pattern, text)
+    return float(match.group(1)) if match else 0.0
+
+
+def test_histogram_buckets():
+    histogram = Histogram((0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value)
+    assert histogram.counts == [2, 1, 1]
+    assert histogram.count == 4
+
+
+def test_metrics_endpoint_reports_routes_and_queries(client, magazine, plan):
+    before = client.get("/metrics").text
+    user_id = random.randint(10**6, 10**7)
+    response = client.post("/subscriptions/", json={
+        "user_id": user_id,
+        "magazine_id": magazine.id,
+        "plan_id": plan.id,
+        "price": 0,
+        "renewal_date": "2024-12-31",
+        "is_active": True,
+    })
+    assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+    client.get(f"/subscriptions/{user_id}/")
+    client.get("/no-such-route")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200, f"Response status code: {response.status_code}"
+    assert response.headers["content-type"].startswith("text/plain")
+    text = response.text
+    route = {"method": "POST", "route": "/subscriptions/"}
+    assert _sample(text, "http_requests_total", **route, status=200) == _sample(before, "http_requests_total", **route, status=200) + 1
+    assert _sample(text, "http_requests_total", method="GET", route="/subscriptions/{user_id}/", status=200) >= 1
+    assert _sample(text, "http_requests_total", method="GET", route="<unmatched>", status=404) >= 1
+    assert _sample(text, "http_request_duration_seconds_count", **route) >= 1
+    assert _sample(text, "http_request_db_queries_sum", **route) > _sample(before, "http_request_db_queries_sum", **route)
+    assert _sample(text, "http_request_db_seconds_sum", **route) > 0
+    assert "http_requests_in_flight 1" in text
+    assert metrics.in_flight == 0
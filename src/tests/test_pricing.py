@@ -0,0 +1,74 @@
+from datetime import date
+
+from sqlalchemy import update
+
+from app.models import Magazine, Plan, User
+from app.pricing import MAGAZINE, PLAN, PriceMatrix, price_matrix
+
+
+def test_price_matrix_updates_incrementally():
+    matrix = PriceMatrix(ttl=60)
+    matrix.build([(1, 100), (2, 40)], [(10, 0.1), (20, 0.25)])
+    assert matrix.lookup([(1, 10), (2, 20), (3, 10)]) == {(1, 10): 100 * (1 - 0.1), (2, 20): 40 * (1 - 0.25)}
+
+    matrix.apply({(MAGAZINE, 2): 80, (PLAN, 10): 0.5, (MAGAZINE, 3): 10, (PLAN, 30): 0.0})
+    assert matrix.magazine_ids == [1, 2, 3] and matrix.plan_ids == [10, 20, 30]
+    assert matrix.prices.tolist() == [
+        [100 * (1 - 0.5), 100 * (1 - 0.25), 100.0],
+        [80 * (1 - 0.5), 80 * (1 - 0.25), 80.0],
+        [10 * (1 - 0.5), 10 * (1 - 0.25), 10.0],
+    ]
+
+    matrix.apply({(MAGAZINE, 1): None, (PLAN, 20): None})
+    assert matrix.as_dict() == {"magazine_ids": [2, 3], "plan_ids": [10, 30], "prices": [[40.0, 80.0], [5.0, 10.0]]}
+
+    # Changes are not applied to a matrix that has to be reloaded anyway
+    matrix.invalidate()
+    matrix.apply({(MAGAZINE, 2): 1})
+    assert not matrix.loaded and matrix.lookup([(2, 10)]) == {(2, 10): 40.0}
+
+
+def test_pricing_matrix_endpoint(client, db, magazine, plan):
+    response = client.get("/pricing/matrix")
+    assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+    body = response.json()
+    i, j = body["magazine_ids"].index(magazine.id), body["plan_ids"].index(plan.id)
+    assert body["prices"][i][j] == magazine.base_price * (1 - plan.discount)
+
+    # A committed base_price change rewrites the row without a reload
+    expires_at = price_matrix.expires_at
+    db.get(Magazine, magazine.id).base_price = 250
+    db.commit()
+    assert price_matrix.expires_at == expires_at
+
+    response = client.get("/pricing/matrix", headers={"If-None-Match": response.headers["ETag"]})
+    assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+    assert response.json()["prices"][i][j] == 250 * (1 - plan.discount)
+
+    # Unrelated writes leave the matrix alone
+    version = price_matrix.version
+    db.get(Plan, plan.id).description = "Renamed"
+    db.commit()
+    assert price_matrix.version == version
+
+
+def test_bulk_subscriptions_priced_from_database(client, db, magazine, plan):
+    assert client.get("/pricing/matrix").status_code == 200
+    user = User(username=f"matrix{magazine.id}", email=f"matrix{magazine.id}@example.com")
+    db.add(user)
+    db.commit()
+    # A price change the matrix never hears of, as from another worker
+    db.execute(update(Magazine).where(Magazine.id == magazine.id).values(base_price=200))
+    db.commit()
+    assert price_matrix.lookup([(magazine.id, plan.id)]) == {(magazine.id, plan.id): magazine.base_price * (1 - plan.discount)}
+
+    response = client.post("/subscriptions/bulk", json=[{
+        "user_id": user.id,
+        "magazine_id": magazine.id,
+        "plan_id": plan.id,
+        "price": 0,
+        "renewal_date": date(2025, 1, 31).isoformat(),
+        "is_active": True,
+    }])
+    assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+    assert response.json()["results"][0]["subscription"]["price"] == 200 * (1 - plan.discount)
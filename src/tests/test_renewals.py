@@ -0,0 +1,105 @@
+from datetime import date
+
+from sqlalchemy import create_engine, update
+from sqlalchemy.orm import Session
+
+from app.db.session import Base
+from app.models import Magazine, Plan, Subscription, SubscriptionStats
+from app import renewals
+from app.renewals import add_months, renew_due_subscriptions, run
+from app.stats import reconcile_stats
+
+
+def test_add_months_clamps_to_month_end():
+    assert add_months(date(2024, 1, 31), 1) == date(2024, 2, 29)
+    assert add_months(date(2024, 11, 15), 3) == date(2025, 2, 15)
+    assert add_months(date(2024, 12, 31), 12) == date(2025, 12, 31)
+
+
+def test_renewals_processed_once_across_workers(tmp_path):
+    database_url = f"sqlite:///{tmp_path / 'renewals.db'}"
+    engine = create_engine(database_url)
+    Base.metadata.create_all(engine)
+    with Session(engine) as db:
+        magazine = Magazine(name="Renewals", description="Renewals", base_price=100)
+        plan = Plan(title="Quarterly", description="Quarterly", renewal_period=3, discount=0.2, tier=1)
+        db.add_all([magazine, plan])
+        db.flush()
+        for user_id in range(1, 51):
+            db.add(Subscription(user_id=user_id, magazine_id=magazine.id, plan_id=plan.id, price=1, renewal_date=date(2024, 6, 1)))
+        db.add(Subscription(user_id=99, magazine_id=magazine.id, plan_id=plan.id, price=1, renewal_date=date(2024, 6, 1), is_active=False))
+        db.add(Subscription(user_id=100, magazine_id=magazine.id, plan_id=plan.id, price=1, renewal_date=date(2024, 9, 1)))
+        db.commit()
+    # Seeded behind the stats' back
+    assert reconcile_stats(engine) == 1
+
+    renewed = run(database_url, as_of=date(2024, 6, 30), processes=2, chunk_size=7)
+    assert renewed == 50
+
+    with Session(engine) as db:
+        subscriptions = db.query(Subscription).all()
+        due = [s for s in subscriptions if s.user_id <= 50]
+        assert {s.renewal_date for s in due} == {date(2024, 9, 1)}
+        assert {s.price for s in due} == {80.0}
+        assert all(s.lease_owner is None for s in due)
+        untouched = [s for s in subscriptions if s.user_id > 50]
+        assert {s.price for s in untouched} == {1.0}
+
+        # Repricing carried the revenue along
+        stats = db.query(SubscriptionStats).one()
+        assert (stats.active_count, stats.active_revenue) == (51, 50 * 80.0 + 1)
+    assert reconcile_stats(engine) == 0
+    engine.dispose()
+
+
+def test_lost_lease_not_counted(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'leases.db'}")
+    Base.metadata.create_all(engine)
+    with Session(engine) as db:
+        magazine = Magazine(name="Leases", description="Leases", base_price=100)
+        plan = Plan(title="Monthly", description="Monthly", renewal_period=1, discount=0.5, tier=1)
+        db.add_all([magazine, plan])
+        db.flush()
+        for user_id in range(1, 6):
+            db.add(Subscription(user_id=user_id, magazine_id=magazine.id, plan_id=plan.id, price=1, renewal_date=date(2024, 6, 1)))
+        db.commit()
+    assert reconcile_stats(engine) == 1
+
+    # The first chunk loses a row to another worker before it is written
+    claim_leased, stolen = renewals._claim_leased, []
+    def claim_and_lose_one(db, as_of, chunk_size, worker_id):
+        rows = claim_leased(db, as_of, chunk_size, worker_id)
+        if rows and not stolen:
+            stolen.append(rows[0].id)
+            db.execute(update(Subscription).where(Subscription.id == rows[0].id).values(lease_owner="other"))
+        return rows
+    monkeypatch.setattr(renewals, "_claim_leased", claim_and_lose_one)
+
+    assert renew_due_subscriptions(engine, as_of=date(2024, 6, 30), chunk_size=2, worker_id="me") == 5
+    assert stolen
+    with Session(engine) as db:
+        subscriptions = db.query(Subscription).all()
+        assert {s.renewal_date for s in subscriptions} == {date(2024, 7, 1)}
+        assert {s.price for s in subscriptions} == {50.0}
+    assert reconcile_stats(engine) == 0
+    engine.dispose()
+
+
+def test_rows_with_missing_catalog_skipped(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'orphans.db'}")
+    Base.metadata.create_all(engine)
+    with Session(engine) as db:
+        magazine = Magazine(name="Orphans", description="Orphans", base_price=100)
+        plan = Plan(title="Monthly", description="Monthly", renewal_period=1, discount=0.0, tier=1)
+        db.add_all([magazine, plan])
+        db.flush()
+        db.add(Subscription(user_id=1, magazine_id=magazine.id, plan_id=plan.id, price=1, renewal_date=date(2024, 6, 1)))
+        # SQLite does not enforce the foreign key: the plan does not exist
+        db.add(Subscription(user_id=2, magazine_id=magazine.id, plan_id=99, price=1, renewal_date=date(2024, 6, 1)))
+        db.commit()
+
+    assert renew_due_subscriptions(engine, as_of=date(2024, 6, 30), chunk_size=10, worker_id="me") == 1
+    with Session(engine) as db:
+        orphan = db.query(Subscription).filter(Subscription.plan_id == 99).one()
+        assert (orphan.renewal_date, orphan.lease_owner) == (date(2024, 6, 1), None)
+    engine.dispose()
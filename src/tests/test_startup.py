@@ -0,0 +1,36 @@
+import subprocess
+import sys
+
+from fastapi import FastAPI
+
+from app.main import create_app, routes
+from benchmarks.importtime import DEFAULT_BUDGET_MS, LAZY_MODULES, SRC, check, measure
+
+
+def test_create_app_registers_routes():
+    app = create_app()
+    assert isinstance(app, FastAPI)
+    paths = {route.path for route in app.routes}
+    assert {path for path, *_ in routes.routes} <= paths
+    assert create_app() is not app
+
+
+def test_import_does_not_build_engines_or_load_drivers():
+    code = (
+        "import sys, app.main\n"
+        "from app.db.session import get_async_engine, get_engine\n"
+        "from app.core.security import get_pwd_context\n"
+        "assert get_engine.cache_info().currsize == 0\n"
+        "assert get_async_engine.cache_info().currsize == 0\n"
+        "assert get_pwd_context.cache_info().currsize == 0\n"
+        f"print(sorted(m for m in {LAZY_MODULES!r} if m in sys.modules))\n"
+    )
+    result = subprocess.run([sys.executable, "-c", code], cwd=SRC, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "[]"
+
+
+def test_import_time_budget():
+    # Best of three, against the CLI budget with headroom for slow CI hosts
+    result = measure("app.main", runs=3)
+    assert check(result, budget_ms=2 * DEFAULT_BUDGET_MS) == []
@@ -0,0 +1,72 @@
+from datetime import date
+
+import pytest
+
+from app.models import Subscription, SubscriptionStats, User
+from app.stats import reconcile_stats, stats_deltas
+from .conftest import engine
+
+
+def test_stats_deltas_aggregate_per_pair():
+    assert stats_deltas([(1, 2, 10.0), (1, 2, 5.0), (3, 2, 1.0)]) == {(1, 2): (2, 15.0), (3, 2): (1, 1.0)}
+    assert stats_deltas([(1, 2, 10.0)], sign=-1) == {(1, 2): (-1, -10.0)}
+
+
+def pair_stats(client, magazine, plan):
+    response = client.get("/stats/subscriptions")
+    assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+    rows = [row for row in response.json()["stats"] if (row["magazine_id"], row["plan_id"]) == (magazine.id, plan.id)]
+    return rows[0] if rows else None
+
+
+@pytest.mark.query_budget({"GET /stats/subscriptions": 1})
+def test_stats_follow_subscription_writes(client, db, query_budget, magazine, plan):
+    users = [User(username=f"stats{magazine.id}-{i}", email=f"stats{magazine.id}-{i}@example.com") for i in range(3)]
+    db.add_all(users)
+    db.commit()
+    price = magazine.base_price * (1 - plan.discount)
+
+    def item(user):
+        return {"user_id": user.id, "magazine_id": magazine.id, "plan_id": plan.id, "price": 0, "renewal_date": "2025-01-31", "is_active": True}
+
+    assert pair_stats(client, magazine, plan) is None
+    response = client.post("/subscriptions/", json=item(users[0]))
+    assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+    subscription_id = response.json()["id"]
+    # A rejected duplicate leaves the stats alone
+    response = client.post("/subscriptions/", json=item(users[0]))
+    assert response.status_code == 400, f"Response status code: {response.status_code}, Response body: {response.text}"
+    response = client.post("/subscriptions/bulk", json=[item(users[1]), item(users[2]), item(users[0])])
+    assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+    assert response.json()["created"] == 2
+
+    row = pair_stats(client, magazine, plan)
+    assert (row["active_subscriptions"], row["revenue"]) == (3, pytest.approx(3 * price))
+    assert row["mrr"] == pytest.approx(3 * price / plan.renewal_period)
+
+    # Cancelling twice only counts once
+    for _ in range(2):
+        response = client.post(f"/subscriptions/{subscription_id}/cancel/")
+        assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+    response = client.post("/subscriptions/cancel", json={"user_id": users[1].id, "magazine_id": magazine.id})
+    assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+
+    row = pair_stats(client, magazine, plan)
+    assert (row["active_subscriptions"], row["revenue"]) == (1, pytest.approx(price))
+
+
+def test_reconcile_corrects_drift(client, db, magazine, plan):
+    user = User(username=f"drift{magazine.id}", email=f"drift{magazine.id}@example.com")
+    db.add(user)
+    db.commit()
+    # Written around the API, so the stats never heard of it
+    db.add(Subscription(user_id=user.id, magazine_id=magazine.id, plan_id=plan.id, price=42, renewal_date=date(2025, 1, 1)))
+    db.commit()
+    assert pair_stats(client, magazine, plan) is None
+
+    assert reconcile_stats(engine) >= 1
+    assert reconcile_stats(engine) == 0
+    stats = db.get(SubscriptionStats, (magazine.id, plan.id))
+    db.refresh(stats)
+    assert (stats.active_count, stats.active_revenue) == (1, 42.0)
+    assert pair_stats(client, magazine, plan)["mrr"] == pytest.approx(42 / plan.renewal_period)
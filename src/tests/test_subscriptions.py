@@ -1,5 +1,15 @@
 from operator import ge
+import csv
+import io
+import json
 import pytest
+from datetime import date
+from sqlalchemy import event
+from app.core.config import settings
+from app.db import dialect
+from app.models import Plan, Subscription, User
+from app.views import SubscriptionResponse
+from .conftest import async_engine, engine
 from .utils import create_user, generate_random_plan_name, login_user, create_plan, create_magazine
 
 
@@ -337,3 +347,338 @@ def test_unique_subscription_constraint(client, unique_username, unique_email):
     # Assert that the second subscription creation attempt fails
     assert response.status_code == 422, f"Response status code: {response.status_code}, Response body: {response.text}"
     assert "already exists" in response.text, "Expected error message for duplicate subscription not found"
+
+
+def test_subscription_lifecycle(client, unique_username, unique_email, magazine, plan):
+    response = client.post("/users/register", json={
+        "username": unique_username,
+        "email": unique_email,
+        "password": "lifecyclepassword",
+    })
+    assert response.status_code == 201, f"Response status code: {response.status_code}, Response body: {response.text}"
+    user_id = response.json()["user_id"]
+
+    response = client.post("/subscriptions/", json={
+        "user_id": user_id,
+        "magazine_id": magazine.id,
+        "plan_id": plan.id,
+        "price": 0,
+        "renewal_date": "2024-12-31",
+        "is_active": True,
+    })
+    assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+    assert response.json()["price"] == magazine.base_price * (1 - plan.discount)
+    subscription_id = response.json()["id"]
+
+    response = client.get(f"/subscriptions/{user_id}/")
+    assert [s["id"] for s in response.json()["subscriptions"]] == [subscription_id]
+
+    response = client.post(f"/subscriptions/{subscription_id}/cancel/")
+    assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+    response = client.get(f"/subscriptions/{user_id}/")
+    assert response.json() == {"subscriptions": [], "next_cursor": None}
+
+
+def test_subscription_rows_encoded_directly(client, db, magazine, plan):
+    user = User(username=f"encode{magazine.id}", email=f"encode{magazine.id}@example.com")
+    db.add(user)
+    db.commit()
+
+    response = client.post("/subscriptions/", json={
+        "user_id": user.id,
+        "magazine_id": magazine.id,
+        "plan_id": plan.id,
+        "price": 0,
+        "renewal_date": "2025-01-31",
+        "is_active": True,
+    })
+    assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+    assert response.headers["content-type"] == "application/json"
+
+    response = client.get(f"/subscriptions/{user.id}/")
+    assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+    (subscription,) = response.json()["subscriptions"]
+    assert set(subscription) == set(SubscriptionResponse.model_fields)
+    assert subscription["renewal_date"] == "2025-01-31"
+
+
+def test_get_subscriptions_paginated(client, db, magazine):
+    user = User(username=f"paged{magazine.id}", email=f"paged{magazine.id}@example.com")
+    plans = [Plan(title=f"Paged plan {magazine.id}-{i}", description="Paged", renewal_period=1, discount=0.0, tier=1) for i in range(3)]
+    db.add_all([user, *plans])
+    db.commit()
+    for plan in plans:
+        db.add(Subscription(user_id=user.id, magazine_id=magazine.id, plan_id=plan.id, price=10, renewal_date=date(2025, 1, 1)))
+    db.commit()
+
+    response = client.get(f"/subscriptions/{user.id}/", params={"limit": 2})
+    page = response.json()
+    assert len(page["subscriptions"]) == 2
+    response = client.get(f"/subscriptions/{user.id}/", params={"limit": 2, "cursor": page["next_cursor"]})
+    last_page = response.json()
+    assert len(last_page["subscriptions"]) == 1
+    assert last_page["next_cursor"] is None
+    ids = [s["id"] for s in page["subscriptions"] + last_page["subscriptions"]]
+    assert ids == sorted(ids)
+
+
+def test_duplicate_active_subscription_rejected(client, db, magazine, plan):
+    user = User(username=f"dup{magazine.id}", email=f"dup{magazine.id}@example.com")
+    db.add(user)
+    db.commit()
+    payload = {
+        "user_id": user.id,
+        "magazine_id": magazine.id,
+        "plan_id": plan.id,
+        "price": 0,
+        "renewal_date": "2025-01-31",
+        "is_active": True,
+    }
+
+    response = client.post("/subscriptions/", json=payload)
+    assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+    response = client.post("/subscriptions/", json=payload)
+    assert response.status_code == 400, f"Response status code: {response.status_code}, Response body: {response.text}"
+    assert "already has an active subscription" in response.json()["detail"]
+
+    # Cancelled subscriptions fall outside the partial index
+    subscription_id = db.query(Subscription.id).filter_by(user_id=user.id).scalar()
+    client.post(f"/subscriptions/{subscription_id}/cancel/")
+    response = client.post("/subscriptions/", json=payload)
+    assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+
+
+def test_subscription_for_unknown_plan_rejected(client, db, magazine):
+    user = User(username=f"noplan{magazine.id}", email=f"noplan{magazine.id}@example.com")
+    db.add(user)
+    db.commit()
+    response = client.post("/subscriptions/", json={
+        "user_id": user.id,
+        "magazine_id": magazine.id,
+        "plan_id": 987654321,
+        "price": 0,
+        "renewal_date": "2025-01-31",
+        "is_active": True,
+    })
+    assert response.status_code == 400, f"Response status code: {response.status_code}, Response body: {response.text}"
+    assert response.json()["detail"] == "Magazine or Plan not found."
+
+
+def test_create_subscription_without_returning(client, db, magazine, plan, monkeypatch):
+    monkeypatch.setattr(dialect, "supports_insert_returning", lambda db: False)
+    user = User(username=f"noreturning{magazine.id}", email=f"noreturning{magazine.id}@example.com")
+    db.add(user)
+    db.commit()
+    payload = {
+        "user_id": user.id,
+        "magazine_id": magazine.id,
+        "plan_id": plan.id,
+        "price": 0,
+        "renewal_date": "2025-01-31",
+        "is_active": True,
+    }
+    response = client.post("/subscriptions/", json=payload)
+    assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+    assert response.json()["user_id"] == user.id
+    assert response.json()["price"] == magazine.base_price * (1 - plan.discount)
+    response = client.post("/subscriptions/", json=payload)
+    assert response.status_code == 400, f"Response status code: {response.status_code}, Response body: {response.text}"
+
+
+@pytest.mark.parametrize("returning", [True, False])
+def test_bulk_subscription_creation(client, db, magazine, plan, monkeypatch, returning):
+    # Without RETURNING the rows are inserted one by one and read back
+    monkeypatch.setattr(dialect, "supports_insert_returning", lambda db: returning)
+    users = [User(username=f"bulk{magazine.id}-{returning}-{i}", email=f"bulk{magazine.id}-{returning}-{i}@example.com") for i in range(3)]
+    db.add_all(users)
+    db.commit()
+    db.add(Subscription(user_id=users[2].id, magazine_id=magazine.id, plan_id=plan.id, price=10, renewal_date=date(2025, 1, 1)))
+    db.commit()
+
+    def item(user_id, magazine_id=magazine.id, plan_id=plan.id):
+        return {
+            "user_id": user_id,
+            "magazine_id": magazine_id,
+            "plan_id": plan_id,
+            "price": 0,
+            "renewal_date": "2025-01-31",
+            "is_active": True,
+        }
+
+    response = client.post("/subscriptions/bulk", json=[
+        item(users[0].id),
+        item(users[1].id),
+        item(users[1].id),
+        item(users[2].id),
+        item(users[0].id, plan_id=987654321),
+    ])
+    assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+    body = response.json()
+    assert (body["created"], body["conflicts"], body["invalid"]) == (2, 2, 1)
+    assert [r["status"] for r in body["results"]] == ["created", "created", "conflict", "conflict", "invalid"]
+    assert body["results"][0]["subscription"]["user_id"] == users[0].id
+    assert body["results"][0]["subscription"]["price"] == magazine.base_price * (1 - plan.discount)
+    assert db.query(Subscription).filter(Subscription.user_id.in_([u.id for u in users])).count() == 3
+
+
+def test_cancel_unknown_subscription(client):
+    response = client.post("/subscriptions/987654321/cancel/")
+    assert response.status_code == 404, f"Response status code: {response.status_code}, Response body: {response.text}"
+
+
+def test_bulk_cancel_subscriptions(client, db, magazine):
+    user = User(username=f"bulkcancel{magazine.id}", email=f"bulkcancel{magazine.id}@example.com")
+    plans = [Plan(title=f"Cancel plan {magazine.id}-{i}", description="Cancel", renewal_period=1, discount=0.0, tier=1) for i in range(3)]
+    db.add_all([user, *plans])
+    db.commit()
+    subscriptions = [
+        Subscription(user_id=user.id, magazine_id=magazine.id, plan_id=plan.id, price=10, renewal_date=date(2025, 1, 1))
+        for plan in plans
+    ]
+    db.add_all(subscriptions)
+    db.commit()
+    ids = [s.id for s in subscriptions]
+
+    response = client.post("/subscriptions/cancel", json={"subscription_ids": ids[:1]})
+    assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+    assert response.json() == {"cancelled": ids[:1], "count": 1}
+
+    # Already cancelled rows are left alone
+    response = client.post("/subscriptions/cancel", json={"user_id": user.id, "magazine_id": magazine.id})
+    assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+    assert sorted(response.json()["cancelled"]) == ids[1:]
+    assert db.query(Subscription).filter(Subscription.id.in_(ids), Subscription.is_active == True).count() == 0
+
+    response = client.post("/subscriptions/cancel", json={"user_id": user.id})
+    assert response.status_code == 422, f"Response status code: {response.status_code}, Response body: {response.text}"
+
+
+def test_export_subscriptions_streams_filtered_rows(client, db, magazine, plan, monkeypatch):
+    # One row per fetch, so the body is assembled from several chunks
+    monkeypatch.setattr(settings, "export_chunk_size", 1)
+    users = [User(username=f"export{magazine.id}-{i}", email=f"export{magazine.id}-{i}@example.com") for i in range(3)]
+    db.add_all(users)
+    db.commit()
+    db.add_all([
+        Subscription(user_id=users[0].id, magazine_id=magazine.id, plan_id=plan.id, price=10, renewal_date=date(2025, 1, 1)),
+        Subscription(user_id=users[1].id, magazine_id=magazine.id, plan_id=plan.id, price=10, renewal_date=date(2025, 3, 1)),
+        Subscription(user_id=users[2].id, magazine_id=magazine.id, plan_id=plan.id, price=10, renewal_date=date(2025, 1, 15), is_active=False),
+    ])
+    db.commit()
+
+    params = {"magazine_id": magazine.id, "is_active": True, "renewal_to": "2025-02-01"}
+    response = client.get("/subscriptions/export", params=params)
+    assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+    assert response.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["user_id"] for row in rows] == [users[0].id]
+    assert rows[0]["renewal_date"] == "2025-01-01"
+
+    response = client.get("/subscriptions/export", params={"format": "csv", "magazine_id": magazine.id})
+    assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+    records = list(csv.DictReader(io.StringIO(response.text)))
+    assert list(records[0]) == list(SubscriptionResponse.model_fields)
+    assert sorted(int(r["user_id"]) for r in records) == sorted(u.id for u in users)
+
+
+
+@pytest.mark.query_budget({
+    "POST /users/register": 2,
+    "POST /subscriptions/": 2,
+    "GET /subscriptions/{user_id}/": 1,
+    "POST /subscriptions/{subscription_id}/cancel/": 2,
+    "POST /subscriptions/cancel": 2,
+})
+def test_subscription_query_budgets(client, query_budget, unique_username, unique_email, magazine, plan):
+    response = client.post("/users/register", json={
+        "username": unique_username,
+        "email": unique_email,
+        "password": "budgetpassword",
+    })
+    assert response.status_code == 201, f"Response status code: {response.status_code}, Response body: {response.text}"
+    user_id = response.json()["user_id"]
+
+    subscription = {
+        "user_id": user_id,
+        "magazine_id": magazine.id,
+        "plan_id": plan.id,
+        "price": 0,
+        "renewal_date": "2024-12-31",
+        "is_active": True,
+    }
+    response = client.post("/subscriptions/", json=subscription)
+    assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+    subscription_id = response.json()["id"]
+    # The conflict path may spend one more statement explaining the failure
+    response = client.post("/subscriptions/", json=subscription)
+    assert response.status_code == 400, f"Response status code: {response.status_code}, Response body: {response.text}"
+
+    response = client.get(f"/subscriptions/{user_id}/")
+    assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+
+    response = client.post(f"/subscriptions/{subscription_id}/cancel/")
+    assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+    response = client.post("/subscriptions/cancel", json={"user_id": user_id, "magazine_id": magazine.id})
+    assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+
+
+def test_upcoming_renewals_keyset_pages(client, db, magazine, plan):
+    # A year of its own, so other tests' subscriptions stay out of range
+    year = 3000 + magazine.id
+    users = [User(username=f"renewing{magazine.id}-{i}", email=f"renewing{magazine.id}-{i}@example.com") for i in range(7)]
+    db.add_all(users)
+    db.commit()
+    renewal_dates = [date(year, 3, 1), date(year, 1, 15), date(year, 1, 15), date(year, 6, 30), date(year, 2, 1)]
+    for user, renewal_date in zip(users, renewal_dates):
+        db.add(Subscription(user_id=user.id, magazine_id=magazine.id, plan_id=plan.id, price=10, renewal_date=renewal_date))
+    db.add(Subscription(user_id=users[5].id, magazine_id=magazine.id, plan_id=plan.id, price=10, renewal_date=date(year, 2, 1), is_active=False))
+    db.add(Subscription(user_id=users[6].id, magazine_id=magazine.id, plan_id=plan.id, price=10, renewal_date=date(year, 7, 1)))
+    db.commit()
+
+    params = {"from": date(year, 1, 1).isoformat(), "to": date(year, 6, 30).isoformat(), "limit": 2}
+    renewals, cursor = [], None
+    while True:
+        response = client.get("/subscriptions/renewals", params={**params, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+        page = response.json()
+        renewals += page["subscriptions"]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert [(s["renewal_date"], s["id"]) for s in renewals] == sorted((s["renewal_date"], s["id"]) for s in renewals)
+    assert [s["renewal_date"] for s in renewals] == sorted(d.isoformat() for d in renewal_dates)
+    assert all(s["is_active"] for s in renewals)
+
+    response = client.get("/subscriptions/renewals", params={**params, "cursor": "bm90LWEtY3Vyc29y"})
+    assert response.status_code == 400, f"Response status code: {response.status_code}, Response body: {response.text}"
+
+
+def test_upcoming_renewals_use_index_range_scan(client, db, magazine, plan):
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    year = 3000 + magazine.id
+    users = [User(username=f"explain{magazine.id}-{i}", email=f"explain{magazine.id}-{i}@example.com") for i in range(2)]
+    db.add_all(users)
+    db.commit()
+    db.add_all([Subscription(user_id=user.id, magazine_id=magazine.id, plan_id=plan.id, price=10, renewal_date=date(year, 5, 1)) for user in users])
+    db.commit()
+    cursor = client.get("/subscriptions/renewals", params={"from": f"{year}-01-01", "to": f"{year}-12-31", "limit": 1}).json()["next_cursor"]
+    event.listen(async_engine.sync_engine, "before_cursor_execute", capture)
+    try:
+        response = client.get("/subscriptions/renewals", params={"from": f"{year}-01-01", "to": f"{year}-12-31", "cursor": cursor})
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", capture)
+    assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+    assert len(response.json()["subscriptions"]) == 1
+
+    (statement, parameters), = statements
+    with engine.connect() as conn:
+        plan = [row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)]
+    assert any(
+        "USING INDEX ix_subscriptions_active_renewal_date (renewal_date>" in detail for detail in plan
+    ), plan
+    # Rows come out of the index in keyset order, without a sort step
+    assert not any("TEMP B-TREE" in detail for detail in plan), plan
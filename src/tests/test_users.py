@@ -1,6 +1,26 @@
+import asyncio
+import os
 import pytest
+import signal
+import time
+import uuid
+from fastapi import HTTPException
+from .conftest import AsyncTestingSessionLocal
 from .utils import create_user, login_user
-from app.core.jwt import create_access_token
+from app.core.auth import Identity, get_current_user
+from app.core.bloom import BloomFilter
+from app.core.config import Settings
+from app.core.jwt import InvalidToken, TokenCache, create_access_token, decode_token, token_cache
+from app.core.security import (
+    BCRYPT_MAX_ROUNDS,
+    BCRYPT_MIN_ROUNDS,
+    HashingPoolBusy,
+    PasswordHasher,
+    calibrate_bcrypt_rounds,
+    password_hasher,
+)
+from app.models import User
+from app.views import RegisteredUsers
 from datetime import timedelta
 
 def test_register_user(client, unique_username, unique_email):
@@ -74,3 +94,257 @@ def test_token_expiry(client, unique_username, unique_email):
     # Verify token has expired
     response = client.get("/users/me", headers=headers)
     assert response.status_code == 401, f"Response status code: {response.status_code}, Response body: {response.text}"
+
+
+def test_login_verifies_password_in_pool(client, unique_username, unique_email):
+    response = client.post("/users/register", json={
+        "username": unique_username,
+        "email": unique_email,
+        "password": "poolpassword"
+    })
+    assert response.status_code == 201, f"Response status code: {response.status_code}, Response body: {response.text}"
+
+    response = client.post("/users/login", json={"email": unique_email, "password": "poolpassword"})
+    assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+    assert response.json()["user_name"] == unique_username
+
+    response = client.post("/users/login", json={"email": unique_email, "password": "wrongpassword"})
+    assert response.status_code == 401, f"Response status code: {response.status_code}, Response body: {response.text}"
+
+
+def test_register_rejected_when_hashing_queue_full(client, unique_username, unique_email, monkeypatch):
+    monkeypatch.setattr(password_hasher, "max_pending", 0)
+    response = client.post("/users/register", json={
+        "username": unique_username,
+        "email": unique_email,
+        "password": "busypassword"
+    })
+    assert response.status_code == 503, f"Response status code: {response.status_code}, Response body: {response.text}"
+    assert response.headers["Retry-After"] == "1"
+
+
+@pytest.mark.asyncio
+async def test_hashing_pool_replaced_after_worker_dies():
+    hasher = PasswordHasher(workers=1, max_pending=4, rounds=4)
+    try:
+        hashed = await hasher.hash("poolpassword")
+        for pid in list(hasher._executor._processes):
+            os.kill(pid, signal.SIGKILL)
+        with pytest.raises(HashingPoolBusy):
+            await hasher.verify("poolpassword", hashed)
+        assert await hasher.verify("poolpassword", hashed)
+    finally:
+        hasher.shutdown()
+
+
+def test_calibrate_bcrypt_rounds_respects_budget():
+    assert calibrate_bcrypt_rounds(target_ms=0) == BCRYPT_MIN_ROUNDS
+    assert BCRYPT_MIN_ROUNDS <= calibrate_bcrypt_rounds(target_ms=50) <= BCRYPT_MAX_ROUNDS
+
+
+def test_login_rehashes_password_at_new_cost(client, db, unique_username, unique_email):
+    previous_rounds = password_hasher.rounds
+    password_hasher.set_rounds(4)
+    try:
+        response = client.post("/users/register", json={
+            "username": unique_username,
+            "email": unique_email,
+            "password": "rehashpassword"
+        })
+        assert response.status_code == 201, f"Response status code: {response.status_code}, Response body: {response.text}"
+        user = db.get(User, response.json()["user_id"])
+        assert user.hashed_password.startswith("$2b$04$")
+
+        password_hasher.set_rounds(5)
+        response = client.post("/users/login", json={"email": unique_email, "password": "rehashpassword"})
+        assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+        db.refresh(user)
+        assert user.hashed_password.startswith("$2b$05$")
+
+        # Lowering the cost rehashes stronger hashes down
+        password_hasher.set_rounds(4)
+        assert password_hasher.needs_update(user.hashed_password)
+        response = client.post("/users/login", json={"email": unique_email, "password": "rehashpassword"})
+        assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+        db.refresh(user)
+        assert user.hashed_password.startswith("$2b$04$")
+    finally:
+        password_hasher.set_rounds(previous_rounds)
+
+
+def test_login_issues_tokens_for_me_and_refresh(client, query_budget, unique_username, unique_email):
+    response = client.post("/users/register", json={
+        "username": unique_username,
+        "email": unique_email,
+        "password": "tokenpassword"
+    })
+    assert response.status_code == 201, f"Response status code: {response.status_code}, Response body: {response.text}"
+    user_id = response.json()["user_id"]
+
+    response = client.post("/users/login", json={"email": unique_email, "password": "tokenpassword"})
+    assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+    tokens = response.json()
+
+    # Identity comes from the token, not the database
+    query_budget["GET /users/me"] = 0
+    for _ in range(2):
+        response = client.get("/users/me", headers={"Authorization": f"Bearer {tokens['access_token']}"})
+        assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+        assert response.json() == {"user_id": user_id, "username": unique_username}
+
+    response = client.post("/users/token/refresh", headers={"Authorization": f"Bearer {tokens['access_token']}"})
+    assert response.status_code == 401, f"Response status code: {response.status_code}, Response body: {response.text}"
+    response = client.get("/users/me", headers={"Authorization": f"Bearer {tokens['refresh_token']}"})
+    assert response.status_code == 401, f"Response status code: {response.status_code}, Response body: {response.text}"
+    response = client.post("/users/token/refresh", headers={"Authorization": f"Bearer {tokens['refresh_token']}"})
+    assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+    assert {"access_token", "refresh_token"} <= response.json().keys()
+
+
+def test_users_me_requires_valid_token(client):
+    response = client.get("/users/me")
+    assert response.status_code == 401, f"Response status code: {response.status_code}, Response body: {response.text}"
+    assert response.headers["WWW-Authenticate"] == "Bearer"
+    response = client.get("/users/me", headers={"Authorization": "Bearer not-a-token"})
+    assert response.status_code == 401, f"Response status code: {response.status_code}, Response body: {response.text}"
+
+
+def test_verified_claims_are_cached_until_expiry(monkeypatch):
+    from jose import jwt
+
+    token_cache.clear()
+    token = create_access_token({"sub": "cached"}, expires_delta=timedelta(minutes=5))
+    assert decode_token(token)["sub"] == "cached"
+
+    def fail(*args, **kwargs):
+        raise AssertionError("token verified again")
+
+    monkeypatch.setattr(jwt, "decode", fail)
+    assert decode_token(token)["sub"] == "cached"
+    monkeypatch.undo()
+
+    expired = create_access_token({"sub": "expired"}, expires_delta=timedelta(seconds=-1))
+    with pytest.raises(InvalidToken):
+        decode_token(expired)
+    # Entries are dropped once their token expires, even if still in the cache
+    claims = decode_token(token)
+    token_cache.set("stale-token", dict(claims, exp=claims["exp"] - 3600))
+    assert token_cache.get("stale-token") is None
+
+
+def test_token_cache_evicts_least_recently_used():
+    cache = TokenCache(max_entries=2)
+    claims = {"sub": "user", "exp": time.time() + 60}
+    cache.set("a", claims)
+    cache.set("b", claims)
+    cache.get("a")
+    cache.set("c", claims)
+    assert cache.get("b") is None
+    assert cache.get("a") is claims and cache.get("c") is claims
+
+
+@pytest.mark.asyncio
+async def test_current_user_loaded_on_demand(db, unique_username, unique_email):
+    user = User(username=unique_username, email=unique_email, hashed_password="x")
+    db.add(user)
+    db.commit()
+    async with AsyncTestingSessionLocal() as session:
+        loaded = await get_current_user(Identity(username=unique_username, user_id=user.id), session)
+        assert loaded.email == unique_email
+        loaded = await get_current_user(Identity(username=unique_username), session)
+        assert loaded.id == user.id
+        with pytest.raises(HTTPException):
+            await get_current_user(Identity(username="someone-else", user_id=user.id), session)
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    for i in range(1000):
+        bloom.add(f"user{i}")
+    assert all(f"user{i}" in bloom for i in range(1000))
+    false_positives = sum(f"other{i}" in bloom for i in range(10000))
+    assert false_positives < 300
+
+
+def test_availability_answered_from_filter(client, query_budget):
+    username, email = f"avail{uuid.uuid4().hex[:12]}", f"avail{uuid.uuid4().hex[:12]}@example.com"
+    query_budget["GET /users/availability"] = 0
+    response = client.get("/users/availability", params={"username": username, "email": email})
+    assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+    assert response.json() == {"username": True, "email": True}
+
+    response = client.post("/users/register", json={"username": username, "email": email, "password": "availpassword"})
+    assert response.status_code == 201, f"Response status code: {response.status_code}, Response body: {response.text}"
+
+    # Possible hits are confirmed against the database
+    query_budget["GET /users/availability"] = 2
+    response = client.get("/users/availability", params={"username": username, "email": f"free{email}"})
+    assert response.status_code == 200, f"Response status code: {response.status_code}, Response body: {response.text}"
+    assert response.json() == {"username": False, "email": True}
+
+    response = client.get("/users/availability")
+    assert response.status_code == 400, f"Response status code: {response.status_code}, Response body: {response.text}"
+
+
+def test_duplicate_registration_rejected_before_hashing(client, monkeypatch):
+    username, email = f"dup{uuid.uuid4().hex[:12]}", f"dup{uuid.uuid4().hex[:12]}@example.com"
+    response = client.post("/users/register", json={"username": username, "email": email, "password": "duppassword"})
+    assert response.status_code == 201, f"Response status code: {response.status_code}, Response body: {response.text}"
+
+    async def no_hashing(password):
+        raise AssertionError("duplicate registration reached bcrypt")
+
+    monkeypatch.setattr(password_hasher, "hash", no_hashing)
+    response = client.post("/users/register", json={"username": username, "email": f"other{email}", "password": "duppassword"})
+    assert response.status_code == 400, f"Response status code: {response.status_code}, Response body: {response.text}"
+    assert response.json()["detail"] == "Username or email already registered"
+
+
+def test_unique_index_backstops_filter(client, db):
+    # Written behind the filter's back, as another worker would
+    username, email = f"race{uuid.uuid4().hex[:12]}", f"race{uuid.uuid4().hex[:12]}@example.com"
+    db.add(User(username=username, email=email, hashed_password="x"))
+    db.commit()
+    response = client.post("/users/register", json={"username": username, "email": f"other{email}", "password": "racepassword"})
+    assert response.status_code == 400, f"Response status code: {response.status_code}, Response body: {response.text}"
+    assert response.json()["detail"] == "Username or email already registered"
+
+
+@pytest.mark.asyncio
+async def test_users_filter_reloaded_in_background(client, db):
+    # Registered through another worker: this worker's filter has not seen it
+    username, email = f"elsewhere{uuid.uuid4().hex[:12]}", f"elsewhere{uuid.uuid4().hex[:12]}@example.com"
+    client.get("/users/availability", params={"username": "warm-up"})
+    db.add(User(username=username, email=email, hashed_password="x"))
+    db.commit()
+    # Requests answer from the current filter and never reload it
+    response = client.get("/users/availability", params={"username": username})
+    assert response.json() == {"username": True}
+
+    users = RegisteredUsers(ttl=0.01)
+    async def session_factory():
+        async with AsyncTestingSessionLocal() as session:
+            yield session
+    reloader = asyncio.ensure_future(users.reload_periodically(session_factory))
+    try:
+        for _ in range(100):
+            if users.filter is not None:
+                break
+            await asyncio.sleep(0.01)
+        assert users.may_be_taken("username", username) and users.may_be_taken("email", email)
+    finally:
+        reloader.cancel()
+
+
+def test_jwt_secret_must_not_be_a_placeholder(monkeypatch):
+    for secret in ("change-me", "too-short"):
+        monkeypatch.setenv("JWT_SECRET_KEY", secret)
+        with pytest.raises(ValueError):
+            Settings()
+    # Unset: refused unless explicitly running a dev server
+    monkeypatch.delenv("JWT_SECRET_KEY")
+    monkeypatch.setenv("JWT_DEV_SECRET", "false")
+    with pytest.raises(ValueError):
+        Settings()
+    monkeypatch.setenv("JWT_DEV_SECRET", "true")
+    assert Settings().jwt_secret_key != Settings().jwt_secret_key